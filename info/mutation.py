@@ -1,44 +1,41 @@
 #!/usr/bin/env python3
 
+import os.path
 import sys
 import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 
-def read_fasta(file_path):
-  with open(file_path, 'r') as file:
-    sequences = {None: ""}
-    header = None
-    for line in file:
-      line = line.strip()
-      if line[0] == ">":
-        header = line[1:].split(" ")[0] # remove > and only take the id (until first space)
-        sequences[header] = ""
-      else:
-        sequences[header] += line
-  if len(sequences[None]) != 0:
-    print("Warning: sequence without header")
-  del sequences[None]
-  return sequences
+# share the fasta reader with ueb04, appended so its code.py does not hide the standard library one
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ueb04'))
+from fasta import read_fasta
+
+# cumulative number of matching positions, matches[i] counts positions before i
+# a gap aligned to a gap is not a match
+def cumulative_matches(seq1, seq2):
+  n = min(len(seq1), len(seq2))
+  a = np.frombuffer(seq1[:n].encode('ascii'), dtype=np.uint8)
+  b = np.frombuffer(seq2[:n].encode('ascii'), dtype=np.uint8)
+  matches = np.zeros(n + 1, dtype=np.int64)
+  np.cumsum((a == b) & (a != ord('-')), out=matches[1:])
+  return matches
 
 def get_similarity(seq1, seq2):
-  length = 0
-  matches = 0
-  for a,b in zip(seq1, seq2):
-    length += 1
-    if a == b != '-':
-      matches += 1
-  return matches / length if length != 0 else 0
+  matches = cumulative_matches(seq1, seq2)
+  length = len(matches) - 1
+  return matches[-1] / length if length != 0 else 0
+
+# mutation rate of every window of length window_length, from the cumulative matches
+# there is no window if it is longer than the sequences
+def window_mutation_rates(matches, window_length):
+  if window_length >= len(matches):
+    return np.zeros(0)
+  window_matches = matches[window_length:] - matches[:len(matches) - window_length]
+  return 1 - window_matches / window_length
 
 # only call this function with exactly two sequences
 def calculate_mutation_rates(sequences, window_length):
-  seq1, seq2 = sequences.values()
-  mutation_rates = []
-  for i in range(0, len(seq1) - window_length + 1):
-    window1 = seq1[i:i+window_length]
-    window2 = seq2[i:i+window_length]
-    similarity = get_similarity(window1, window2)
-    mutation_rates.append(1 - similarity)
-  return mutation_rates
+  return window_mutation_rates(cumulative_matches(*sequences.values()), window_length)
 
 def plot_mutation_rates(mutation_rates, window_length, file_name):
   plt.figure(figsize=(10, 4))
@@ -50,6 +47,12 @@ def plot_mutation_rates(mutation_rates, window_length, file_name):
   plt.savefig(file_name.replace('.fasta', f'_{window_length}.png'))
   plt.close()
 
+def positive_int(value):
+  value = int(value)
+  if value <= 0:
+    raise argparse.ArgumentTypeError(f"{value} is not a positive window length")
+  return value
+
 def main():
   # parse args
   parser = argparse.ArgumentParser(
@@ -57,11 +60,10 @@ def main():
     description='compare mutation of two aligned sequences, plot the result'
   )
   parser.add_argument('fasta_file', help="a fasta file with exactly two aligned sequences")
-  parser.add_argument('-l', '--length', default=500, help="the window length to compute compute the mutation in")
+  parser.add_argument('-l', '--length', type=positive_int, nargs='+', default=[500], help="the window lengths to compute the mutation in")
   args = parser.parse_args()
 
   fasta_file = args.fasta_file
-  window_length = int(args.length)
 
   # read file
   if not fasta_file.endswith('.fasta'):
@@ -73,24 +75,38 @@ def main():
     print("There are not exactly two sequences in the fasta file", file=sys.stderr)
     sys.exit(1)
 
+  # the matches are computed once, every window length is a difference of them
+  matches = cumulative_matches(*sequences.values())
+
   # print whole genome stats
-  print(f"whole sequence mutation: {(1 - get_similarity(*sequences.values()))*100:.3f}%")
-
-  # calculate windows
-  mutation_rates = calculate_mutation_rates(sequences, window_length)
-
-  # plot windows
-  plot_mutation_rates(mutation_rates, window_length, fasta_file)
-  
-  # gather stats on windows
-  max_rate = max(mutation_rates)
-  min_rate = min(mutation_rates)
-  max_pos = mutation_rates.index(max_rate)
-  min_pos = mutation_rates.index(min_rate)
-
-  # print stats on windows
-  print(f'max mutation rate: {max_rate*100:>7.3f}% at position: {max_pos:>7}')
-  print(f'min mutation rate: {min_rate*100:>7.3f}% at position: {min_pos:>7}')
+  length = len(matches) - 1
+  similarity = matches[-1] / length if length != 0 else 0
+  print(f"whole sequence mutation: {(1 - similarity)*100:.3f}%")
+
+  for i, window_length in enumerate(args.length):
+    if len(args.length) > 1:
+      if i != 0:
+        print()
+      print(f"calculating window length {window_length}", file=sys.stderr)
+
+    # calculate windows
+    mutation_rates = window_mutation_rates(matches, window_length)
+    if len(mutation_rates) == 0:
+      print(f"window length {window_length} is longer than the sequences", file=sys.stderr)
+      continue
+
+    # plot windows
+    plot_mutation_rates(mutation_rates, window_length, fasta_file)
+
+    # gather stats on windows
+    max_pos = int(np.argmax(mutation_rates))
+    min_pos = int(np.argmin(mutation_rates))
+    max_rate = mutation_rates[max_pos]
+    min_rate = mutation_rates[min_pos]
+
+    # print stats on windows
+    print(f'max mutation rate: {max_rate*100:>7.3f}% at position: {max_pos:>7}')
+    print(f'min mutation rate: {min_rate*100:>7.3f}% at position: {min_pos:>7}')
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
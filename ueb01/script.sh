@@ -2,3 +2,6 @@ muscle -in abc.fasta -out abc_aligned.fasta
 fprotdist -sequence abc_aligned.fasta out.fasta
 fneighbour
 # orthofinder für ganze genome
+# ohne alignment: minhash sketches und mash distanzen, auch für viele genome
+# python3 ../ueb04/minhash.py sketch -p -r abc.fasta -o abc.npz
+# python3 ../ueb04/minhash.py dist abc.npz -o abc.dist && fneighbour -datafile abc.dist
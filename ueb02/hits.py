@@ -0,0 +1,168 @@
+# diamond blastp hit tables (--outfmt 6, the default) as numpy column arrays
+# the file is read in large chunks, each chunk is split into fields and converted
+# column by column, so there is no python work per row
+import hashlib
+import os
+import os.path
+import tempfile
+
+import numpy as np
+
+# the 12 default columns of outfmt 6 and their types, ids are kept as bytes
+COLUMNS = (
+    ("qseqid", "S"),
+    ("sseqid", "S"),
+    ("pident", np.float64),
+    ("length", np.int64),
+    ("mismatch", np.int64),
+    ("gapopen", np.int64),
+    ("qstart", np.int64),
+    ("qend", np.int64),
+    ("sstart", np.int64),
+    ("send", np.int64),
+    ("evalue", np.float64),
+    ("bitscore", np.float64),
+)
+
+def empty_table(): # -> {column: np.array}
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+
+# rows of every column where mask (or index array) is set
+def take(table, rows):
+    return {name: column[rows] for name, column in table.items()}
+
+def concatenate(tables):
+    tables = list(tables)
+    if not tables:
+        return empty_table()
+    return {name: np.concatenate([table[name] for table in tables]) for name, _ in COLUMNS}
+
+# complete lines of outfmt 6 -> column arrays
+def parse_chunk(data): # bytes -> {column: np.array}
+    fields = data.replace(b'\r', b'').replace(b'\n', b'\t').split(b'\t')
+    fields.pop() # the chunk ends with a line break, so the last field is empty
+    rows = len(fields) // len(COLUMNS)
+    if rows * len(COLUMNS) != len(fields):
+        raise ValueError(f"expected {len(COLUMNS)} columns in hit table")
+    table = dict()
+    for i, (name, dtype) in enumerate(COLUMNS):
+        column = np.array(fields[i::len(COLUMNS)], dtype=bytes)
+        table[name] = column if dtype == "S" else column.astype(dtype)
+    return table
+
+# yields the column arrays of chunks of about chunk_size bytes, always cut at line breaks
+def iter_chunks(hit_file, chunk_size=64 * 2**20):
+    with open(hit_file, 'rb') as f:
+        rest = b""
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b'\n') + 1
+            rest = data[end:]
+            if end:
+                yield parse_chunk(data[:end])
+        if rest.strip():
+            yield parse_chunk(rest + b'\n')
+
+# the hit with the highest bitscore of every query, the first one on ties
+# the rows stay in their order in the table
+def best_hits(table):
+    order = np.lexsort((-table["bitscore"], table["qseqid"]))
+    query = table["qseqid"][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = query[1:] != query[:-1]
+    return take(table, np.sort(order[first]))
+
+# every hit that is the best hit of its query for some e-value threshold:
+# no other hit of the query has a lower or equal e-value and a better bitscore (or the same, earlier in the table)
+# best_hits of these filtered by any max_evalue is the same as of the whole table
+def pareto_hits(table):
+    n = len(table["qseqid"])
+    # rank 0 is the hit best_hits would choose, highest bitscore and then first in the table
+    rank = np.empty(n, dtype=np.int64)
+    rank[np.lexsort((np.arange(n), -table["bitscore"]))] = np.arange(n)
+    order = np.lexsort((rank, table["evalue"], table["qseqid"]))
+    query = table["qseqid"][order]
+    first = np.ones(n, dtype=bool)
+    first[1:] = query[1:] != query[:-1]
+    # running best rank within each query, later queries start higher so they are not affected by earlier ones
+    group = np.cumsum(first) - 1
+    value = group * n + (n - 1 - rank[order])
+    best = np.maximum.accumulate(value)
+    keep = first.copy()
+    keep[1:] |= value[1:] > best[:-1]
+    return take(table, np.sort(order[keep]))
+
+# all hits with an e-value of at most max_evalue
+def read_hits(hit_file, max_evalue=None, chunk_size=64 * 2**20):
+    tables = []
+    for table in iter_chunks(hit_file, chunk_size):
+        if max_evalue is not None:
+            table = take(table, table["evalue"] <= max_evalue)
+        tables.append(table)
+    return concatenate(tables)
+
+# best hit of every query with an e-value of at most max_evalue
+# each chunk is reduced on its own, so only the best hits are kept in memory
+# with a HitCache the pareto_hits of the file are stored, so the next read with any max_evalue skips parsing
+def read_best_hits(hit_file, max_evalue=None, chunk_size=64 * 2**20, cache=None):
+    if cache is not None:
+        table = cache.get(hit_file)
+        if table is None:
+            table = pareto_hits(concatenate(pareto_hits(table) for table in iter_chunks(hit_file, chunk_size)))
+            cache.put(hit_file, table)
+        if max_evalue is not None:
+            table = take(table, table["evalue"] <= max_evalue)
+        return best_hits(table)
+    tables = []
+    for table in iter_chunks(hit_file, chunk_size):
+        if max_evalue is not None:
+            table = take(table, table["evalue"] <= max_evalue)
+        tables.append(best_hits(table))
+    # a query can be split between two chunks
+    return best_hits(concatenate(tables))
+
+# {query: (subject, e-value, bitscore)} of the best hits
+def read_matches(match_file, max_evalue=1e-20, cache=None):
+    table = read_best_hits(match_file, max_evalue, cache=cache)
+    queries = table["qseqid"].astype(str).tolist()
+    subjects = table["sseqid"].astype(str).tolist()
+    return dict(zip(queries, zip(subjects, table["evalue"].tolist(), table["bitscore"].tolist())))
+
+# parsed hit tables as .npz files, keyed by the path, size and modification time of the hit file
+# a changed file gets a new key, the entries of its older versions are removed when the new one is written
+class HitCache:
+    def __init__(self, directory=os.path.join("out", "cache")):
+        self.directory = directory
+
+    def prefix(self, hit_file):
+        return hashlib.sha256(os.path.abspath(hit_file).encode()).hexdigest()[:32]
+
+    def path(self, hit_file):
+        stat = os.stat(hit_file)
+        return os.path.join(self.directory, f"{self.prefix(hit_file)}-{stat.st_size}-{stat.st_mtime_ns}.npz")
+
+    def get(self, hit_file): # -> {column: np.array} | None
+        try:
+            with np.load(self.path(hit_file)) as data:
+                return {name: data[name] for name, _ in COLUMNS}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, hit_file, table):
+        path = self.path(hit_file)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a temporary file and rename, parallel readers never see half written entries
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **table)
+            os.replace(tmp, path)
+            prefix = self.prefix(hit_file) + "-"
+            for entry in os.listdir(self.directory):
+                if entry.startswith(prefix) and entry != os.path.basename(path):
+                    os.unlink(os.path.join(self.directory, entry))
+        except OSError:
+            pass # without a cache the file is just parsed again
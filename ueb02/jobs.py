@@ -0,0 +1,133 @@
+# parallel diamond runs with outputs named by the content of their inputs
+# a job whose output exists is up to date, because a changed input gives a new name.
+# jobs write to a .part file that is renamed when they are done, so after an
+# interruption the next run only repeats the unfinished jobs
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import subprocess
+import sys
+
+DIAMOND = os.environ.get("DIAMOND", "/vol/software/bin/diamond-2.0.0")
+
+_digests = dict()
+# sha256 of the content of a file, remembered by path, size and modification time
+def file_digest(path): # -> str
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                h.update(block)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+def digest(*parts): # -> str
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+class Job:
+    # command is a list of arguments, "{output}" in it is replaced by the temporary output path
+    # part is the temporary output path, it has to end like output if the program insists on an extension
+    def __init__(self, name, command, output, inputs=(), deps=(), part=None):
+        self.name = name
+        self.inputs = list(inputs)
+        self.command = command
+        self.output = output
+        self.deps = list(deps)
+        self.part = part or output + ".part"
+
+    def up_to_date(self):
+        return os.path.exists(self.output)
+
+    def run(self): # -> bool, False if the job was skipped
+        if self.up_to_date():
+            return False
+        os.makedirs(os.path.dirname(self.output) or ".", exist_ok=True)
+        if os.path.exists(self.part): # left over from an interrupted run
+            os.unlink(self.part)
+        command = [arg.replace("{output}", self.part) for arg in self.command]
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            if os.path.exists(self.part):
+                os.unlink(self.part)
+            raise RuntimeError(f"{self.name}: exit code {result.returncode}\n{result.stderr.strip()}")
+        os.replace(self.part, self.output)
+        return True
+
+# diamond database of a protein fasta file
+def makedb_job(faa, db_directory, diamond=DIAMOND, threads=1):
+    key = digest("makedb", os.path.basename(diamond), file_digest(faa))
+    output = os.path.join(db_directory, key + ".dmnd")
+    command = [diamond, "makedb", "--in", faa, "-d", "{output}", "--threads", str(threads)]
+    # diamond appends .dmnd to database names without it
+    return Job(f"makedb {faa}", command, output, inputs=[faa], part=os.path.join(db_directory, key + ".part.dmnd"))
+
+# blastp of query against the database of makedb, output is the default tabular format
+def blastp_job(query, makedb, hit_directory, diamond=DIAMOND, threads=1, options=()):
+    key = digest("blastp", os.path.basename(diamond), file_digest(query), os.path.basename(makedb.output), *options)
+    output = os.path.join(hit_directory, key + ".tsv")
+    command = [diamond, "blastp", "-d", makedb.output, "-q", query, "-o", "{output}", "--threads", str(threads), *options]
+    return Job(f"blastp {query} in {makedb.inputs[0]}", command, output, inputs=[query], deps=[makedb])
+
+KMER_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kmer_index.py")
+
+# spaced seed index of a protein fasta file, see kmer_index.py
+def kmer_index_job(faa, index_directory):
+    key = digest("kmer_index build", file_digest(KMER_INDEX), file_digest(faa))
+    output = os.path.join(index_directory, key + ".npz")
+    command = [sys.executable, KMER_INDEX, "build", faa, "-o", "{output}"]
+    return Job(f"kmer index {faa}", command, output, inputs=[faa])
+
+# candidates of query in the index, written like a diamond hit table
+def kmer_search_job(query, index, hit_directory, options=()):
+    key = digest("kmer_index search", file_digest(KMER_INDEX), file_digest(query), os.path.basename(index.output), *options)
+    output = os.path.join(hit_directory, key + ".tsv")
+    command = [sys.executable, KMER_INDEX, "search", query, index.output, "-o", "{output}", *options]
+    return Job(f"kmer search {query} in {index.inputs[0]}", command, output, inputs=[query], deps=[index])
+
+# run jobs on a pool of workers, a job starts when all its dependencies are done
+# returns the failed jobs with their errors, jobs depending on a failed job or on a job
+# that is not in jobs are not run and count as failed
+def run_jobs(jobs, workers=1, log=sys.stderr): # -> [(Job, Exception)]
+    pending = list(jobs)
+    done = set()
+    failed = []
+    running = dict()
+    total = len(pending)
+    finished = 0
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        while pending or running:
+            for job in list(pending):
+                if any(dep in (f for f, _ in failed) for dep in job.deps):
+                    pending.remove(job)
+                    failed.append((job, RuntimeError(f"{job.name}: a dependency failed")))
+                elif all(dep in done for dep in job.deps):
+                    pending.remove(job)
+                    running[executor.submit(job.run)] = job
+            if not running:
+                # the rest waits for dependencies that are not in jobs
+                for job in pending:
+                    failed.append((job, RuntimeError(f"{job.name}: a dependency is not in the job list")))
+                break
+            completed, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                job = running.pop(future)
+                finished += 1
+                try:
+                    ran = future.result()
+                    done.add(job)
+                    print(f"[{finished}/{total}] {job.name}" + ("" if ran else " (up to date)"), file=log)
+                except Exception as e: # a failed job must not stop the others
+                    failed.append((job, e))
+                    print(f"[{finished}/{total}] failed {e}", file=log)
+    return failed
+
+# link name to target with a relative symlink, replacing an older link
+def link(target, name):
+    tmp = name + ".link"
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    os.symlink(os.path.relpath(target, os.path.dirname(name) or "."), tmp)
+    os.replace(tmp, name)
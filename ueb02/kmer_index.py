@@ -0,0 +1,173 @@
+# protein k-mer index for candidate homologs without diamond
+# sequences are written in a reduced alphabet of 10 groups of similar amino acids
+# and cut into spaced seeds (1 = position used, 0 = ignored), so a few substitutions
+# still leave shared seeds. the index stores the distinct (seed, protein) pairs sorted by seed,
+# a query protein's candidates are the proteins sharing the most seeds with it.
+# search writes the candidates like diamond --outfmt 6, so the rbh scripts can use them directly:
+# length is the number of shared seeds, bitscore the shared seeds per 100 query seeds and e-value 0
+import argparse
+import os.path
+import sys
+
+import numpy as np
+
+# share the fasta reader with ueb04, appended so its code.py does not hide the standard library one
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ueb04'))
+from fasta import iter_fasta
+
+# Murphy et al. (2000), 10 letter alphabet
+REDUCED = ("LVIM", "C", "A", "G", "ST", "P", "FYW", "EDNQ", "KR", "H")
+SEEDS = ("11101101", "110100111")
+
+INVALID = 255
+reduced_table = np.full(256, INVALID, dtype=np.uint8)
+for i, group in enumerate(REDUCED):
+    for aa in group:
+        reduced_table[ord(aa)] = i
+        reduced_table[ord(aa.lower())] = i
+
+# all sequences in one array, separated by INVALID so no seed spans two proteins
+# returns the reduced codes and the offset of each protein
+def encode(sequences): # -> (np.array(uint8), np.array(int))
+    data = "\0".join(sequences).encode('ascii', 'replace')
+    offsets = np.cumsum([0] + [len(s) + 1 for s in sequences])
+    return reduced_table[np.frombuffer(data, dtype=np.uint8)], offsets
+
+# seed codes of every start position of one spaced seed, and which of them are valid
+def seed_codes(encoded, seed): # -> (np.array(int64), np.array(bool))
+    n = max(len(encoded) - len(seed) + 1, 0)
+    codes = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for p in (i for i, c in enumerate(seed) if c == "1"):
+        x = encoded[p:p+n]
+        valid &= x != INVALID
+        codes = codes * len(REDUCED) + x
+    return codes, valid
+
+# distinct (seed, protein) pairs of all seeds, seeds are offset so different spaced seeds never collide
+def seed_pairs(sequences, seeds=SEEDS): # -> (codes, proteins) sorted by code
+    encoded, offsets = encode(sequences)
+    codes, proteins = [], []
+    for s, seed in enumerate(seeds):
+        c, valid = seed_codes(encoded, seed)
+        starts = np.flatnonzero(valid)
+        codes.append(c[starts] + s * len(REDUCED) ** len(seed))
+        proteins.append(np.searchsorted(offsets, starts, side='right') - 1)
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+    proteins = np.concatenate(proteins) if proteins else np.zeros(0, dtype=np.int64)
+    n = max(len(sequences), 1)
+    keys = np.unique(codes * n + proteins)
+    return keys // n, keys % n
+
+class KmerIndex:
+    def __init__(self, ids, codes, proteins, seeds=SEEDS):
+        self.ids = list(ids)
+        self.codes = codes # sorted
+        self.proteins = proteins
+        self.seeds = tuple(seeds)
+        # distinct seeds, where their proteins start and how many there are
+        self.unique, self.starts, self.counts = np.unique(codes, return_index=True, return_counts=True)
+
+    @classmethod
+    def build(cls, ids, sequences, seeds=SEEDS):
+        codes, proteins = seed_pairs(sequences, seeds)
+        return cls(ids, codes, proteins, seeds)
+
+    @classmethod
+    def from_fasta(cls, fasta_file, seeds=SEEDS):
+        records = list(iter_fasta(fasta_file))
+        return cls.build([id for id, _ in records], [sequence for _, sequence in records], seeds)
+
+    def save(self, path):
+        np.savez(path, ids=np.array(self.ids, dtype=bytes), codes=self.codes, proteins=self.proteins, seeds=np.array(self.seeds, dtype=bytes))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["ids"].astype(str).tolist(), data["codes"], data["proteins"], data["seeds"].astype(str).tolist())
+
+    # (query, target, shared seeds) of the top candidates of every query protein
+    # seeds in more than max_occurrences targets (low complexity, repeats) are ignored
+    def search(self, sequences, top=5, min_shared=2, max_occurrences=200, batch=10000):
+        results = []
+        for first in range(0, len(sequences) if len(self.unique) else 0, batch):
+            query_codes, queries = seed_pairs(sequences[first:first+batch], self.seeds)
+            i = np.minimum(np.searchsorted(self.unique, query_codes), len(self.unique) - 1)
+            found = (self.unique[i] == query_codes) & (self.counts[i] <= max_occurrences)
+            i, queries = i[found], queries[found] + first
+            # expand every found seed to all target proteins that have it
+            lengths = self.counts[i]
+            position = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(self.starts[i], lengths)
+            targets = self.proteins[position]
+            queries = np.repeat(queries, lengths)
+            keys, shared = np.unique(queries * len(self.ids) + targets, return_counts=True)
+            query, target = keys // len(self.ids), keys % len(self.ids)
+            # best first within each query
+            order = np.lexsort((target, -shared, query))
+            query, target, shared = query[order], target[order], shared[order]
+            group_start = np.flatnonzero(np.r_[True, query[1:] != query[:-1]])
+            rank = np.arange(len(query)) - np.repeat(group_start, np.diff(np.r_[group_start, len(query)]))
+            keep = (rank < top) & (shared >= min_shared)
+            results.append((query[keep], target[keep], shared[keep]))
+        if not results:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty
+        return tuple(np.concatenate(column) for column in zip(*results))
+
+# seeds of every query protein, to normalize the score
+def seed_counts(sequences, seeds=SEEDS): # -> np.array
+    _, proteins = seed_pairs(sequences, seeds)
+    return np.bincount(proteins, minlength=len(sequences))
+
+# candidates in diamond --outfmt 6 columns, see the top of the file
+def write_hits(output_file, query_ids, target_ids, query, target, shared, query_seeds):
+    score = 100 * shared / np.maximum(query_seeds[query], 1)
+    for q, t, s, b in zip(query.tolist(), target.tolist(), shared.tolist(), score.tolist()):
+        print(query_ids[q], target_ids[t], 0, s, 0, 0, 0, 0, 0, 0, 0, f"{b:.1f}", sep="\t", file=output_file)
+
+# the records of query_file that have a candidate in hit_file, for a prefiltered search
+def candidate_fasta(query_file, hit_file, width=60): # -> str
+    with open(hit_file) as f:
+        candidates = {line.split("\t", 1)[0] for line in f}
+    lines = []
+    for id, sequence in iter_fasta(query_file):
+        if id in candidates:
+            lines.append(">" + id)
+            lines.extend(sequence[i:i+width] for i in range(0, len(sequence), width))
+    return "".join(line + "\n" for line in lines)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='kmer_index',
+        description='spaced seed index of proteins for candidate homologs'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="index a protein fasta file")
+    build.add_argument('fasta_file')
+    build.add_argument('-o', '--output', required=True, help="index file (.npz)")
+    search = subparsers.add_parser('search', help="candidates of query proteins in an index")
+    search.add_argument('query_file', help="protein fasta file")
+    search.add_argument('index_file', help="index of kmer_index.py build")
+    search.add_argument('-o', '--output', default='/dev/fd/1', help="output file, default stdout")
+    search.add_argument('--top', type=int, default=5, help="candidates per query, default 5")
+    search.add_argument('--min-shared', type=int, default=2, help="minimum number of shared seeds, default 2")
+    search.add_argument('--max-occurrences', type=int, default=200, help="ignore seeds in more proteins, default 200")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index = KmerIndex.from_fasta(args.fasta_file)
+        with open(args.output, 'wb') as f:
+            index.save(f)
+        print(f"{len(index.ids)} proteins, {len(index.unique)} seeds", file=sys.stderr)
+        return
+
+    index = KmerIndex.load(args.index_file)
+    records = list(iter_fasta(args.query_file))
+    query_ids = [id for id, _ in records]
+    sequences = [sequence for _, sequence in records]
+    query, target, shared = index.search(sequences, args.top, args.min_shared, args.max_occurrences)
+    with open(args.output, "w") as output_file:
+        write_hits(output_file, query_ids, index.ids, query, target, shared, seed_counts(sequences, index.seeds))
+
+if __name__ == "__main__":
+    main()
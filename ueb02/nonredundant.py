@@ -0,0 +1,105 @@
+# identical proteins of all proteomes collapsed into clusters before the homology search
+# every distinct sequence is one cluster, named nr<number> in order of first occurrence.
+# a cluster that occurs in both genomes of a pair is its own reciprocal best hit,
+# so only the clusters of a genome that are missing in the other one have to be searched
+# (against all clusters of the other genome), the rest is expanded from the cluster map
+import hashlib
+import os
+import os.path
+import sys
+from collections import defaultdict
+
+# share the fasta reader with ueb04, appended so its code.py does not hide the standard library one
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ueb04'))
+from fasta import iter_fasta
+
+def genome_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+class Clusters:
+    def __init__(self):
+        self.index = dict() # sequence digest -> cluster
+        self.sequences = [] # sequence of each cluster
+        self.members = defaultdict(lambda: defaultdict(list)) # genome -> cluster -> proteins
+
+    @classmethod
+    def from_proteomes(cls, paths):
+        clusters = cls()
+        for path in paths:
+            genome = genome_name(path)
+            for protein, sequence in iter_fasta(path):
+                clusters.add(genome, protein, sequence)
+        return clusters
+
+    def add(self, genome, protein, sequence): # -> str, the cluster
+        key = hashlib.sha256(sequence.encode()).digest()
+        if key not in self.index:
+            self.index[key] = f"nr{len(self.sequences)}"
+            self.sequences.append(sequence)
+        cluster = self.index[key]
+        self.members[genome][cluster].append(protein)
+        return cluster
+
+    def sequence(self, cluster):
+        return self.sequences[int(cluster[2:])]
+
+    def proteins(self):
+        return sum(len(proteins) for members in self.members.values() for proteins in members.values())
+
+    # clusters of genome that do not occur in other
+    def missing(self, genome, other):
+        return [cluster for cluster in self.members[genome] if cluster not in self.members[other]]
+
+    def fasta(self, clusters, width=60): # -> str
+        lines = []
+        for cluster in clusters:
+            sequence = self.sequence(cluster)
+            lines.append(">" + cluster)
+            lines.extend(sequence[i:i+width] for i in range(0, len(sequence), width))
+        return "".join(line + "\n" for line in lines)
+
+    # cluster map: cluster, genome, protein
+    def write_map(self, path):
+        with open(path, "w") as f:
+            for genome, members in self.members.items():
+                for cluster, proteins in members.items():
+                    for protein in proteins:
+                        print(cluster, genome, protein, sep="\t", file=f)
+
+# {genome: {cluster: [proteins]}} from a cluster map
+def read_map(path):
+    members = defaultdict(lambda: defaultdict(list))
+    with open(path) as f:
+        for line in f:
+            cluster, genome, protein = line.rstrip("\n").split("\t")
+            members[genome][cluster].append(protein)
+    return members
+
+# only rewrite files whose content changed, so the hashes in jobs.py stay cached
+def write_if_changed(path, text):
+    try:
+        with open(path) as f:
+            if f.read() == text:
+                return path
+    except FileNotFoundError:
+        pass
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+# write directory/all.faa (one sequence per cluster), directory/clusters.tsv and
+# directory/<genome>.faa with the clusters of every genome
+def write_nonredundant(clusters, directory):
+    os.makedirs(directory, exist_ok=True)
+    write_if_changed(os.path.join(directory, "all.faa"), clusters.fasta(f"nr{i}" for i in range(len(clusters.sequences))))
+    clusters.write_map(os.path.join(directory, "clusters.tsv"))
+    return {
+        genome: write_if_changed(os.path.join(directory, genome + ".faa"), clusters.fasta(members))
+        for genome, members in clusters.members.items()
+    }
+
+# the clusters of genome that are missing in reference, the queries of genome against reference
+def write_query(clusters, genome, reference, directory):
+    os.makedirs(os.path.join(directory, "queries"), exist_ok=True)
+    path = os.path.join(directory, "queries", f"{genome}_not_{reference}.faa")
+    return write_if_changed(path, clusters.fasta(clusters.missing(genome, reference)))
@@ -0,0 +1,126 @@
+# reciprocal best hits between all pairs of proteomes and orthogroups from them
+# every hit file out/X_v_Y.tsv (X queried against a database of Y) is read exactly once,
+# the rbh edges of all pairs are joined into orthogroups with union-find
+import concurrent.futures
+import itertools
+import os.path
+
+import numpy as np
+
+import hits
+
+def hit_file(directory, query_name, reference_name):
+    return os.path.join(directory, f"{query_name}_v_{reference_name}.tsv")
+
+# best hit of every query as (queries, subjects) arrays of bytes
+# cache is a hits.HitCache or None
+def best_pairs(hit_file, max_evalue=1e-20, cache=None): # -> (np.array, np.array)
+    table = hits.read_best_hits(hit_file, max_evalue, cache=cache)
+    return table["qseqid"], table["sseqid"]
+
+# pairs (a, b) where b is the best hit of a and a is the best hit of b
+def reciprocal_best_hits(forward, reverse): # -> (np.array, np.array)
+    queries, subjects = forward
+    reverse_queries, reverse_subjects = reverse
+    order = np.argsort(reverse_queries)
+    reverse_queries, reverse_subjects = reverse_queries[order], reverse_subjects[order]
+    if not len(reverse_queries):
+        return queries[:0], subjects[:0]
+    # look up the best hit of each subject in the reverse direction
+    i = np.minimum(np.searchsorted(reverse_queries, subjects), len(reverse_queries) - 1)
+    reciprocal = (reverse_queries[i] == subjects) & (reverse_subjects[i] == queries)
+    return queries[reciprocal], subjects[reciprocal]
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]] # path halving
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            # the smaller root stays, so group ids follow the node order
+            if y < x:
+                x, y = y, x
+            self.parent[y] = x
+
+    def roots(self): # -> np.array, the root of every node
+        return np.array([self.find(x) for x in range(len(self.parent))], dtype=np.int64)
+
+# read the best hits of every ordered pair of genomes with a process pool
+# returns {(query genome, reference genome): (queries, subjects)}
+def load_all(genomes, directory="out", max_evalue=1e-20, jobs=None, cache=None):
+    pairs = list(itertools.permutations(genomes, 2))
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        files = [hit_file(directory, query, reference) for query, reference in pairs]
+        return dict(zip(pairs, executor.map(best_pairs, files, itertools.repeat(max_evalue), itertools.repeat(cache))))
+
+# rbh edges of all unordered pairs of genomes: {(genome a, genome b): (proteins of a, proteins of b)}
+def all_reciprocal_best_hits(best, genomes):
+    return {
+        (a, b): reciprocal_best_hits(best[(a, b)], best[(b, a)])
+        for a, b in itertools.combinations(genomes, 2)
+    }
+
+# rbh edges between clusters of identical proteins (nonredundant.py) expanded to the proteins
+# clusters in both genomes of a pair are their own reciprocal best hit, they were not searched.
+# members is {genome: {cluster: [proteins]}}, identical proteins of one genome all get the same partners
+def expand_edges(edges, members):
+    expanded = dict()
+    for (a, b), (clusters_a, clusters_b) in edges.items():
+        shared = [cluster for cluster in members[a] if cluster in members[b]]
+        proteins_a, proteins_b = [], []
+        for x, y in zip(clusters_a.astype(str).tolist() + shared, clusters_b.astype(str).tolist() + shared):
+            for protein_a in members[a][x]:
+                for protein_b in members[b][y]:
+                    proteins_a.append(protein_a)
+                    proteins_b.append(protein_b)
+        expanded[(a, b)] = (np.array(proteins_a, dtype=bytes), np.array(proteins_b, dtype=bytes))
+    return expanded
+
+# connected components of the rbh graph, nodes are (genome, protein)
+# returns (genome index, protein, orthogroup) arrays, orthogroups are numbered from 0 in node order
+def orthogroups(edges, genomes):
+    # all proteins that have at least one rbh, numbered genome by genome
+    proteins = []
+    for g, genome in enumerate(genomes):
+        members = [pair[0] for (a, _), pair in edges.items() if a == genome]
+        members += [pair[1] for (_, b), pair in edges.items() if b == genome]
+        proteins.append(np.unique(np.concatenate(members)) if members else np.zeros(0, dtype=bytes))
+    offsets = np.cumsum([0] + [len(p) for p in proteins])
+    index = {genome: g for g, genome in enumerate(genomes)}
+
+    def node(genome, names):
+        g = index[genome]
+        return offsets[g] + np.searchsorted(proteins[g], names)
+
+    union_find = UnionFind(int(offsets[-1]))
+    for (a, b), (proteins_a, proteins_b) in edges.items():
+        for x, y in zip(node(a, proteins_a).tolist(), node(b, proteins_b).tolist()):
+            union_find.union(x, y)
+    roots = union_find.roots()
+    _, group = np.unique(roots, return_inverse=True)
+    genome = np.repeat(np.arange(len(genomes)), [len(p) for p in proteins])
+    return genome, np.concatenate(proteins) if proteins else np.zeros(0, dtype=bytes), group
+
+# number of proteins of every genome in every orthogroup, (genomes, orthogroups)
+def presence_matrix(genome, group, n_genomes):
+    n_groups = int(group.max()) + 1 if len(group) else 0
+    counts = np.bincount(genome * n_groups + group, minlength=n_genomes * n_groups)
+    return counts.reshape(n_genomes, n_groups)
+
+def write_presence_matrix(output_file, genomes, matrix):
+    print("genome", *(f"OG{j}" for j in range(matrix.shape[1])), sep="\t", file=output_file)
+    for genome, row in zip(genomes, matrix.tolist()):
+        print(genome, *row, sep="\t", file=output_file)
+
+def write_orthogroups(output_file, genomes, genome, protein, group):
+    order = np.lexsort((genome, group))
+    for g, p, o in zip(genome[order].tolist(), protein[order].astype(str).tolist(), group[order].tolist()):
+        print(f"OG{o}", genomes[g], p, sep="\t", file=output_file)
@@ -1,96 +1,165 @@
 import argparse
 from collections import defaultdict
 import csv
+import itertools
 import os
 import os.path
-import subprocess
 import sys
 
-e_epsilon = 1e-20
+from hits import read_matches
+import jobs
+import kmer_index
+import nonredundant
 
-# expects a standard blastp output from diamond
-def read_matches(match_file):
-    matches = dict()
-    with open(match_file) as f:
-        reader = csv.reader(f, delimiter="\t")
-        for row in reader:
-            protein = row[0]
-            match = row[1]
-            e_value = float(row[10])
-            score = row[11]
-            if e_value > e_epsilon:
-                continue
-            if protein not in matches or score < matches[protein][2]:
-                matches[protein] = (match, e_value, score)
-    return matches
+e_epsilon = 1e-20
 
 def main():
     parser = argparse.ArgumentParser(
         prog='script',
         description='compare proteomes'
     )
-    parser.add_argument('target', help="One of the filenames in the proteomes folder")
+    parser.add_argument('target', nargs='?', help="One of the filenames in the proteomes folder")
+    parser.add_argument('--all', action='store_true', help="run diamond for all pairs of proteomes, for script2.py --all")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="number of diamond jobs at the same time, default cores / threads")
+    parser.add_argument('-t', '--threads', type=int, default=1, help="threads of each diamond job, default 1")
+    parser.add_argument('--collapse', action='store_true', help="search only one protein of each set of identical proteins, results go to out/nr")
+    parser.add_argument('--search', choices=['diamond', 'kmer'], default='diamond', help="diamond, or the approximate spaced seed search of kmer_index.py that needs no diamond")
+    parser.add_argument('--prefilter', action='store_true', help="only query proteins with k-mer candidates in the reference with diamond")
+    parser.add_argument('--diamond', default=jobs.DIAMOND, help=f"diamond executable, default $DIAMOND or {jobs.DIAMOND}")
     args = parser.parse_args()
 
-    target = args.target
-    target_file = os.path.basename(target)
+    if args.target is None and not args.all:
+        parser.error("a target or --all is required")
+    if args.prefilter and args.search != 'diamond':
+        parser.error("--prefilter only works with --search diamond")
+
+    proteomes = sorted(
+        os.path.join('proteomes', file)
+        for file in os.listdir('proteomes')
+        if os.path.splitext(file)[1] == '.faa'
+    )
 
-    target_name, target_extension = os.path.splitext(target_file)
+    if args.all:
+        target = None
+        pairs = list(itertools.permutations(proteomes, 2))
+    else:
+        target = os.path.normpath(args.target)
+        target_file = os.path.basename(target)
 
-    if target_extension != '.faa':
-        print("only works with .faa file endings", file=sys.stderr)
-        return
+        target_name, target_extension = os.path.splitext(target_file)
 
-    print("target: " + target_name)
+        if target_extension != '.faa':
+            print("only works with .faa file endings", file=sys.stderr)
+            return
+
+        print("target: " + target_name)
+        references = [reference for reference in proteomes if reference != target]
+        # query target in reference and reference in target
+        pairs = [(target, reference) for reference in references] + [(reference, target) for reference in references]
 
     try:
         os.mkdir("out")
     except FileExistsError:
         pass
 
+    # with --collapse identical proteins are searched once, see nonredundant.py
+    # the databases hold the clusters of a genome and only the clusters missing in the reference are queried
+    hit_directory = "out"
+    if args.collapse:
+        hit_directory = os.path.join("out", "nr")
+        clusters = nonredundant.Clusters.from_proteomes(proteomes)
+        cluster_files = nonredundant.write_nonredundant(clusters, hit_directory)
+        queries = {
+            (query, reference): nonredundant.write_query(clusters, nonredundant.genome_name(query), nonredundant.genome_name(reference), hit_directory)
+            for query, reference in pairs
+        }
+        searched = sum(len(clusters.missing(nonredundant.genome_name(query), nonredundant.genome_name(reference))) for query, reference in pairs)
+        full = sum(sum(len(p) for p in clusters.members[nonredundant.genome_name(query)].values()) for query, _ in pairs)
+        print(f"{clusters.proteins()} proteins in {len(clusters.sequences)} clusters, {searched} of {full} queries left", file=sys.stderr)
+
+    # the query and database fasta files of every pair, pairs without queries are not searched
+    inputs = dict()
+    for query, reference in pairs:
+        if args.collapse:
+            query_input = queries[(query, reference)]
+            if os.path.getsize(query_input) > 0:
+                inputs[(query, reference)] = (query_input, cluster_files[nonredundant.genome_name(reference)])
+        else:
+            inputs[(query, reference)] = (query, reference)
+
+    # databases and hit tables are named by the hashes of their inputs, see jobs.py
+    # out/X_v_Y.tsv (out/nr/X_v_Y.tsv) links to the hits of X queried against Y
+    workers = args.jobs or max(1, (os.cpu_count() or 1) // args.threads)
+    failed = []
+    databases = dict()
+    search_jobs = dict()
+    if args.search == 'kmer' or args.prefilter:
+        for (query, reference), (query_input, database_input) in inputs.items():
+            if reference not in databases:
+                databases[reference] = jobs.kmer_index_job(database_input, os.path.join("out", "kmer"))
+            search_jobs[(query, reference)] = jobs.kmer_search_job(query_input, databases[reference], os.path.join("out", "kmer"))
+    if args.prefilter:
+        # diamond only gets the queries that have k-mer candidates in the reference
+        failed = jobs.run_jobs([*databases.values(), *search_jobs.values()], workers)
+        os.makedirs(os.path.join("out", "prefilter"), exist_ok=True)
+        for (query, reference), (query_input, database_input) in list(inputs.items()):
+            if (query, reference) not in search_jobs or not os.path.exists(search_jobs[(query, reference)].output):
+                continue
+            query_name, reference_name = nonredundant.genome_name(query), nonredundant.genome_name(reference)
+            path = os.path.join("out", "prefilter", f"{query_name}_in_{reference_name}.faa")
+            nonredundant.write_if_changed(path, kmer_index.candidate_fasta(query_input, search_jobs[(query, reference)].output))
+            if os.path.getsize(path) > 0:
+                inputs[(query, reference)] = (path, database_input)
+            else:
+                del inputs[(query, reference)]
+        databases, search_jobs = dict(), dict()
+    if args.search == 'diamond':
+        for (query, reference), (query_input, database_input) in inputs.items():
+            if reference not in databases:
+                databases[reference] = jobs.makedb_job(database_input, os.path.join("out", "db"), args.diamond, args.threads)
+            search_jobs[(query, reference)] = jobs.blastp_job(query_input, databases[reference], os.path.join("out", "hits"), args.diamond, args.threads)
+
+    failed += jobs.run_jobs([*databases.values(), *search_jobs.values()], workers)
+    empty = os.path.join(hit_directory, "empty.tsv")
+    open(empty, "a").close()
+    for query, reference in pairs:
+        job = search_jobs.get((query, reference))
+        output = job.output if job else empty # nothing to search
+        if os.path.exists(output):
+            query_name = nonredundant.genome_name(query)
+            reference_name = nonredundant.genome_name(reference)
+            jobs.link(output, os.path.join(hit_directory, f"{query_name}_v_{reference_name}.tsv"))
+    if failed:
+        for job, e in failed:
+            print(e, file=sys.stderr)
+        sys.exit(1)
+    if target is None:
+        return
+
     # compare target to each reference
     matches_reciprocal = defaultdict(dict)
-    references = []
-    for file in os.listdir('proteomes'):
-        reference = os.path.join('proteomes', file)
-        if target == reference:
-            continue
-        references.append(reference)
-
-        # query target in reference
-        print("##########")
-        print("query target in reference")
-        print("##########")
-        matches1 = os.path.join("out", "matches1.tsv")
-        subprocess.call([
-            "/vol/software/bin/diamond-2.0.0", 
-            "blastp", 
-            "-d", 
-            reference,
-            "-q",
-            target,
-            "-o",
-            matches1
-        ])
-
+    for reference in references:
         # read forward matches
-        matches = read_matches(matches1)
-
-        # query reference in target
-        matches2 = os.path.join("out", "matches2.tsv")
-        subprocess.call([
-            "/vol/software/bin/diamond-2.0.0", 
-            "blastp", 
-            "-d", 
-            target,
-            "-q",
-            reference,
-            "-o",
-            matches2
-        ])
+        matches = read_matches(os.path.join(hit_directory, f"{target_name}_v_{nonredundant.genome_name(reference)}.tsv"), e_epsilon)
 
         # read reverse matches
-        matches_reverse = read_matches(matches2)
+        matches_reverse = read_matches(os.path.join(hit_directory, f"{nonredundant.genome_name(reference)}_v_{target_name}.tsv"), e_epsilon)
+
+        if args.collapse:
+            # matches are between clusters, expand them to the proteins
+            target_members = clusters.members[target_name]
+            reference_members = clusters.members[nonredundant.genome_name(reference)]
+            for cluster, proteins in target_members.items():
+                if cluster in reference_members:
+                    partner = cluster # identical protein
+                elif cluster in matches and matches_reverse.get(matches[cluster][0], ("",))[0] == cluster:
+                    partner = matches[cluster][0]
+                else:
+                    continue
+                for protein in proteins:
+                    matches_reciprocal[protein][reference] = reference_members[partner][0]
+            matches = [protein for proteins in target_members.values() for protein in proteins]
+            continue
 
         # for each protein in target find the reciprocal best match in reference
         for protein in matches:
@@ -101,7 +170,7 @@ def main():
                 continue
             if protein == reciprocal:
                 matches_reciprocal[protein][reference] = match
-    
+
     # write output
     with open(os.path.join("out", "reciprocal.tsv"), "w") as f:
         writer = csv.writer(f, delimiter="\t")
@@ -116,4 +185,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -5,33 +5,59 @@ import os
 import os.path
 import sys
 
+from hits import HitCache, read_matches
+import nonredundant
+import rbh
+
 e_epsilon = 1e-20
 
-def read_matches(match_file):
-    matches = dict()
-    with open(match_file) as f:
-        reader = csv.reader(f, delimiter="\t")
-        for row in reader:
-            protein = row[0]
-            match = row[1]
-            e_value = float(row[10])
-            score = row[11]
-            if e_value > e_epsilon:
-                continue
-            if protein not in matches or score < matches[protein][2]:
-                matches[protein] = (match, e_value, score)
-    return matches
+# orthogroups of all proteomes, every out/X_v_Y.tsv is read once
+# with collapsed the hits are between clusters of identical proteins, from script.py --collapse
+def all_vs_all(output_file, groups_file=None, jobs=None, cache=None, collapsed=False):
+    genomes = sorted(
+        os.path.splitext(file)[0]
+        for file in os.listdir('proteomes')
+        if os.path.splitext(file)[1] == '.faa'
+    )
+    print(f"{len(genomes)} genomes", file=sys.stderr)
+    directory = os.path.join("out", "nr") if collapsed else "out"
+    best = rbh.load_all(genomes, directory, e_epsilon, jobs, cache)
+    edges = rbh.all_reciprocal_best_hits(best, genomes)
+    if collapsed:
+        edges = rbh.expand_edges(edges, nonredundant.read_map(os.path.join(directory, "clusters.tsv")))
+    print(f"{sum(len(a) for a, _ in edges.values())} reciprocal best hits", file=sys.stderr)
+    genome, protein, group = rbh.orthogroups(edges, genomes)
+    matrix = rbh.presence_matrix(genome, group, len(genomes))
+    print(f"{matrix.shape[1]} orthogroups", file=sys.stderr)
+    with open(output_file, "w") as f:
+        rbh.write_presence_matrix(f, genomes, matrix)
+    if groups_file:
+        with open(groups_file, "w") as f:
+            rbh.write_orthogroups(f, genomes, genome, protein, group)
 
 def main():
     parser = argparse.ArgumentParser(
         prog='script',
         description='compare proteomes'
     )
-    parser.add_argument('target', help="One of the filenames in the proteomes folder")
+    parser.add_argument('target', nargs='?', help="One of the filenames in the proteomes folder")
     parser.add_argument('-o', '--output', help="Output filename", required=True)
+    parser.add_argument('--all', action='store_true', help="all vs all: write a genomes x orthogroups presence matrix to the output file")
+    parser.add_argument('--groups', help="with --all: also write the proteins of every orthogroup to this file")
+    parser.add_argument('-j', '--jobs', type=int, help="with --all: number of processes reading hit files, default all cores")
+    parser.add_argument('--collapsed', action='store_true', help="with --all: use the hits between identical protein clusters of script.py --collapse")
+    parser.add_argument('--cache-dir', default=os.path.join("out", "cache"), help="directory for parsed hit tables, default out/cache")
+    parser.add_argument('--no-cache', action='store_true', help="always parse the hit tables")
     args = parser.parse_args()
 
     output_file = args.output
+    cache = None if args.no_cache else HitCache(args.cache_dir)
+
+    if args.all:
+        all_vs_all(output_file, args.groups, args.jobs, cache, args.collapsed)
+        return
+    if args.target is None:
+        parser.error("a target or --all is required")
 
     target = args.target
     target_file = os.path.basename(target)
@@ -64,10 +90,10 @@ def main():
         references.append(reference)
 
         matches_forward_file = os.path.join("out", f"{target_name}_v_{reference_name}.tsv")
-        matches = read_matches(matches_forward_file)
+        matches = read_matches(matches_forward_file, e_epsilon, cache)
 
         matches_reverse_file = os.path.join("out", f"{reference_name}_v_{target_name}.tsv")
-        matches_reverse = read_matches(matches_reverse_file)
+        matches_reverse = read_matches(matches_reverse_file, e_epsilon, cache)
 
         # for each protein in target find the reciprocal best match in reference
         for protein in matches:
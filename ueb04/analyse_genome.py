@@ -1,25 +1,203 @@
 import sys
+import os
+import io
 import csv
 import argparse
+import contextlib
+import concurrent.futures
 from collections import defaultdict
 
 import numpy as np
 import pyrodigal
-import Bio.SeqIO
 
+import fasta
 import frames
 import code
+import codon_usage
+import composition
+import training_cache
 
 def nucleotid_count(sequence):
-    result = {nt: 0 for nt in "ATCGN"}
-    for nt in sequence:
-        result[nt] += 1
-    return result
+    return composition.composition(sequence)
 
 def calculate_gc_content(sequence):
-    nts = nucleotid_count(sequence)
-    gc_count = nts['C'] + nts['G']
-    return (gc_count / len(sequence)) if sequence else 0
+    return composition.gc_content(sequence)
+
+# prodigal needs at least this many bases to train, shorter assemblies use the metagenomic models
+min_training_length = 20000
+
+# training_info: use this profile (e.g. of a reference genome) instead of training
+# cache: training_cache.TrainingCache to look up and store training infos
+# table: ncbi translation table used for training
+def find_genes(contigs, threads=1, training_info=None, cache=None, table=11): # [str] -> [pyrodigal.Genes], one per contig
+    if training_info is not None:
+        gene_finder = pyrodigal.GeneFinder(training_info)
+    elif sum(len(c) for c in contigs) >= min_training_length:
+        # train once on all contigs, pyrodigal joins them with linkers like prodigal does
+        gene_finder = pyrodigal.GeneFinder(training_cache.train(contigs, cache, translation_table=table))
+    else:
+        print("assembly too short for training, using metagenomic mode", file=sys.stderr)
+        gene_finder = pyrodigal.GeneFinder(meta=True)
+    if threads == 1 or len(contigs) == 1:
+        return [gene_finder.find_genes(c) for c in contigs]
+    # find_genes releases the gil, so threads run in parallel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(gene_finder.find_genes, contigs))
+
+# gene_tables: directory to write a table of codon usage bias per gene to
+# cai_weights: relative adaptiveness of the codons for the cai, default from all genes of the file
+def analyse_file(file, threads=1, training_info=None, cache=None, table=11, gene_tables=None, cai_weights=None): # -> tsv row
+    row = []
+
+    print(file, file=sys.stderr)
+    print("reading fasta from " + file, file=sys.stderr)
+    global sequences
+    sequences = list(fasta.iter_fasta(file))
+    if not sequences:
+        raise ValueError("no sequences in fasta")
+
+    # name the row after the sequence, or after the file for multi contig assemblies
+    if len(sequences) == 1:
+        row.append(sequences[0][0])
+    else:
+        row.append(os.path.splitext(os.path.basename(file))[0])
+        print(f"{len(sequences)} contigs", file=sys.stderr)
+
+    global contigs
+    contigs = [seq for _, seq in sequences]
+
+    print("finding genes", file=sys.stderr)
+    global contig_genes
+    contig_genes = find_genes(contigs, threads, training_info, cache, table)
+
+    global genes
+    genes = [g for contig in contig_genes for g in contig]
+    if not genes:
+        raise ValueError("no genes found")
+
+    print("calculating statistics", file=sys.stderr)
+
+    sequence_lengths = [g.end - g.begin + 1 for g in genes]
+
+    # Whole genome length
+    genome_length = sum(len(c) for c in contigs)
+    print(f"Length of Genome: {genome_length}", file=sys.stderr)
+    row.append(genome_length)
+
+    # Total Length of all Genes
+    genes_total_length = sum(sequence_lengths)
+    print(f"Total length of all genes: {genes_total_length} bases", file=sys.stderr)
+    row.append(genes_total_length)
+
+    # Number of Genes
+    genes_length = len(genes)
+    print(f"Number of genes: {genes_length}", file=sys.stderr)
+
+    # Genes Length Statistics
+    min_length = min(sequence_lengths)
+    max_length = max(sequence_lengths)
+    quartiles_length = np.percentile(sequence_lengths, [25, 50, 75])
+    print(f"Length Min/Quartiles/Max: {min_length}, {quartiles_length[0]}, {quartiles_length[1]}, {quartiles_length[2]}, {max_length}", file=sys.stderr)
+    row += [min_length, *quartiles_length, max_length]
+
+    # GC Content
+    genome_gc = float(composition.gc_fraction(composition.composition_matrix(contigs).sum(axis=0)))
+    print(f"Whole Genome GC Conent: {genome_gc*100:0.4f}%", file=sys.stderr)
+    row.append(genome_gc)
+
+    gc_contens = np.concatenate([
+        composition.interval_gc(contig, [g.begin - 1 for g in found], [g.end for g in found])
+        for contig, found in zip(contigs, contig_genes)
+    ])
+    min_gc = min(gc_contens)
+    max_gc = max(gc_contens)
+    quartiles_gc = np.percentile(gc_contens, [25, 50, 75])
+    print(f"Length Min/Quartiles/Max: {min_gc*100:0.4f}%, {quartiles_gc[0]*100:0.4f}%, {quartiles_gc[1]*100:0.4f}%, {quartiles_gc[2]*100:0.4f}%, {max_gc*100:0.4f}%", file=sys.stderr)
+    row += [min_gc, *quartiles_gc, max_gc]
+
+    # Coding Density
+    coding_density = genes_total_length / (genome_length * 2) # Count Forward and Backward Strand
+    print(f"Coding Density: {coding_density*100: 0.4}%", file=sys.stderr)
+    row.append(coding_density)
+
+    # Start Codonsstart_codons
+    start_codons = defaultdict(int)
+    for g in genes:
+        start_codons[g.start_type] += 1
+
+    row.append(start_codons.get("ATG", 0))
+    row.append(start_codons.get("GTG", 0))
+    row.append(start_codons.get("TTG", 0))
+    row.append(start_codons.get("Edge", 0))
+    start_codon_count = sum(start_codons.values())
+    start_codons = sorted(list(start_codons.items()), key=lambda x: -x[1])
+    start_codons = ", ".join(f"{codon}: {float(count)/start_codon_count*100:0.4f}%" for codon, count in start_codons)
+    print(f"Start Codon Distribution: {start_codons}", file=sys.stderr)
+
+    # codon usage in genome
+    genome_codon_counts = sum(frames.codon_usage(contig) for contig in contigs)
+    codon_counts = dict(zip(frames.CODONS, genome_codon_counts.tolist()))
+    codon_count = sum(codon_counts.values())
+    row += [ float(c) / codon_count for c in genome_codon_counts[code.codon_order].tolist()]
+    codon_counts_print = sorted(codon_counts.items(), key=lambda x: -x[1])
+    codon_counts_print = ", ".join(f"{codon}: {float(count) / codon_count * 100:0.4f}%" for codon, count in codon_counts_print)
+    print(f"Codon Distribution Whole Genome: {codon_counts_print}", file=sys.stderr)
+
+    # codon usage in genes
+    gene_codon_counts = sum(
+        frames.gene_codon_usage(contig, [g.begin for g in found], [g.end for g in found], [g.strand for g in found])
+        for contig, found in zip(contigs, contig_genes)
+    )
+    codon_counts = dict(zip(frames.CODONS, gene_codon_counts.tolist()))
+    codon_count = sum(codon_counts.values())
+    row += [ float(c) / codon_count for c in gene_codon_counts[code.codon_order].tolist()]
+    codon_counts_print = sorted(codon_counts.items(), key=lambda x: -x[1])
+    codon_counts_print = ", ".join(f"{codon}: {float(count) / codon_count * 100:0.4f}%" for codon, count in codon_counts_print)
+    print(f"Codon Distribution Genes: {codon_counts_print}", file=sys.stderr)
+
+    # codon usage bias per gene
+    if gene_tables is not None:
+        counts = np.concatenate([
+            codon_usage.gene_count_matrix(contig, [g.begin for g in found], [g.end for g in found], [g.strand for g in found])
+            for contig, found in zip(contigs, contig_genes)
+        ])
+        weights = cai_weights if cai_weights is not None else codon_usage.relative_adaptiveness(counts, table)
+        gene_rows = [
+            (name, g.begin, g.end, g.strand, g.start_type)
+            for (name, _), found in zip(sequences, contig_genes) for g in found
+        ]
+        gene_table = os.path.join(gene_tables, os.path.splitext(os.path.basename(file))[0] + ".genes.tsv")
+        print(f"writing codon usage per gene to {gene_table}", file=sys.stderr)
+        with open(gene_table, "w") as f:
+            codon_usage.write_gene_table(f, gene_rows, counts, gc_contens, weights, table)
+
+    return row
+
+# analyse_file with everything it prints to stderr captured,
+# so the output of parallel workers does not interleave
+def analyse_file_captured(file, **kwargs): # -> (row | None, log, error | None)
+    log = io.StringIO()
+    with contextlib.redirect_stderr(log):
+        try:
+            row = analyse_file(file, **kwargs)
+        except Exception as e:
+            return None, log.getvalue(), f"{type(e).__name__}: {e}"
+    return row, log.getvalue(), None
+
+# yields (index, row | None, log, error | None) for each file as soon as it is done
+# kwargs are passed on to analyse_file
+def analyse_files(files, jobs=1, **kwargs):
+    if jobs == 1:
+        for i, file in enumerate(files):
+            try:
+                yield i, analyse_file(file, **kwargs), "", None
+            except Exception as e:
+                yield i, None, "", f"{type(e).__name__}: {e}"
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(analyse_file_captured, file, **kwargs): i for i, file in enumerate(files)}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], *future.result()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -27,116 +205,57 @@ def main():
         description='print stats for a fasta file'
     )
     parser.add_argument('files', metavar='FILE', type=str, nargs='+', help="input file, default stdin")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="number of files to analyse in parallel, 0 for all cores")
+    parser.add_argument('-t', '--threads', type=int, default=0, help="threads for gene finding on the contigs of a file, default cores / jobs")
+    parser.add_argument('-g', '--table', type=int, default=11, help="ncbi translation table, default 11")
+    parser.add_argument('--gene-tables', metavar='DIR', help="write rscu, cai and enc of every gene to DIR/<file>.genes.tsv")
+    parser.add_argument('--cai-reference', metavar='FASTA', help="coding sequences of highly expressed genes to compute the cai against, default all genes of each file")
+    parser.add_argument('-r', '--reference', help="train once on this fasta and use the profile for all files")
+    parser.add_argument('--cache-dir', help="directory of the training cache, default ~/.cache/jlu-bio/pyrodigal")
+    parser.add_argument('--cache-size', type=int, default=256, help="size limit of the training cache in MB")
+    parser.add_argument('--no-cache', action='store_true', help="always train, don't read or write the training cache")
     args = parser.parse_args()
 
+    jobs = args.jobs or os.cpu_count()
+    threads = args.threads or max(1, os.cpu_count() // jobs)
+    cache = None if args.no_cache else training_cache.TrainingCache(args.cache_dir, args.cache_size * 2**20)
+
+    cai_weights = None
+    if args.cai_reference:
+        reference_counts = codon_usage.count_matrix([seq for _, seq in fasta.iter_fasta(args.cai_reference)])
+        cai_weights = codon_usage.relative_adaptiveness(reference_counts, args.table)
+    if args.gene_tables:
+        os.makedirs(args.gene_tables, exist_ok=True)
+
+    training_info = None
+    if args.reference:
+        print(f"training on reference {args.reference}", file=sys.stderr)
+        training_info = training_cache.train([seq for _, seq in fasta.iter_fasta(args.reference)], cache, translation_table=args.table)
     tsv_writer = csv.writer(sys.stdout, delimiter="\t")
 
-    for file in args.files:
-        row = []
-
-        print(file, file=sys.stderr)
-        print("reading fasta from " + file, file=sys.stderr)
-        global sequences
-        sequences = list(Bio.SeqIO.parse(file, "fasta"))
-
-        # TODO extend to multi chromosomes
-        if len(sequences) != 1:
-            print("expecting exactly one sequence in fasta, found len(sequences)")
-            sys.exit(1)
-
-        row.append(sequences[0].id)
-
-        global sequence
-        sequence = str(sequences[0].seq)
-
-        print("finding genes", file=sys.stderr)
-        gene_finder = pyrodigal.GeneFinder()
-        gene_finder.train(sequence)
-
-        global genes
-        genes = gene_finder.find_genes(sequence)
-
-        print("calculating statistics", file=sys.stderr)
-
-        sequence_lengths = [g.end - g.begin + 1 for g in genes]
-
-        # Whole genome length
-        genome_length = len(sequence)
-        print(f"Length of Genome: {genome_length}", file=sys.stderr)
-        row.append(genome_length)
-
-        # Total Length of all Genes
-        genes_total_length = sum(sequence_lengths)
-        print(f"Total length of all genes: {genes_total_length} bases", file=sys.stderr)
-        row.append(genes_total_length)
-
-        # Number of Genes
-        genes_length = len(genes)
-        print(f"Number of genes: {genes_length}", file=sys.stderr)
-
-        # Genes Length Statistics
-        min_length = min(sequence_lengths)
-        max_length = max(sequence_lengths)
-        quartiles_length = np.percentile(sequence_lengths, [25, 50, 75])
-        print(f"Length Min/Quartiles/Max: {min_length}, {quartiles_length[0]}, {quartiles_length[1]}, {quartiles_length[2]}, {max_length}", file=sys.stderr)
-        row += [min_length, *quartiles_length, max_length]
-
-        # GC Content
-        genome_gc = calculate_gc_content(sequence)
-        print(f"Whole Genome GC Conent: {genome_gc*100:0.4f}%", file=sys.stderr)
-        row.append(genome_gc)
-
-        gc_contens = [ calculate_gc_content(g.sequence()) for g in genes ]
-        min_gc = min(gc_contens)
-        max_gc = max(gc_contens)
-        quartiles_gc = np.percentile(gc_contens, [25, 50, 75])
-        print(f"Length Min/Quartiles/Max: {min_gc*100:0.4f}%, {quartiles_gc[0]*100:0.4f}%, {quartiles_gc[1]*100:0.4f}%, {quartiles_gc[2]*100:0.4f}%, {max_gc*100:0.4f}%", file=sys.stderr)
-        row += [min_gc, *quartiles_gc, max_gc]
-
-        # Coding Density
-        coding_density = genes_total_length / (genome_length * 2) # Count Forward and Backward Strand
-        print(f"Coding Density: {coding_density*100: 0.4}%", file=sys.stderr)
-        row.append(coding_density)
-
-        # Start Codonsstart_codons
-        start_codons = defaultdict(int)
-        for g in genes:
-            start_codons[g.start_type] += 1
-        
-        row.append(start_codons.get("ATG", 0))
-        row.append(start_codons.get("GTG", 0))
-        row.append(start_codons.get("TTG", 0))
-        row.append(start_codons.get("Edge", 0))
-        start_codon_count = sum(start_codons.values())
-        start_codons = sorted(list(start_codons.items()), key=lambda x: -x[1])
-        start_codons = ", ".join(f"{codon}: {float(count)/start_codon_count*100:0.4f}%" for codon, count in start_codons)
-        print(f"Start Codon Distribution: {start_codons}", file=sys.stderr)
-
-        # codon usage in genome
-        codon_counts = defaultdict(int)
-        for seq in frames.frames(sequence):
-            for (_, codon) in seq:
-                codon_counts[codon] += 1
-        codon_count = sum(codon_counts.values())
-        codon_counts_row = sorted(codon_counts.items(), key=lambda x: code.codon_sort_key(x[0]))
-        row += [ float(c) / codon_count for _, c in codon_counts_row]
-        codon_counts_print = sorted(codon_counts.items(), key=lambda x: -x[1])
-        codon_counts_print = ", ".join(f"{codon}: {float(count) / codon_count * 100:0.4f}%" for codon, count in codon_counts_print)
-        print(f"Codon Distribution Whole Genome: {codon_counts_print}", file=sys.stderr)
-
-        # codon usage in genes
-        codon_counts = defaultdict(int)
-        for gene in genes:
-            for (_, codon) in frames.codons(gene.sequence()):
-                codon_counts[codon] += 1
-        codon_count = sum(codon_counts.values())
-        codon_counts_row = sorted(codon_counts.items(), key=lambda x: code.codon_sort_key(x[0]))
-        row += [ float(c) / codon_count for _, c in codon_counts_row]
-        codon_counts_print = sorted(codon_counts.items(), key=lambda x: -x[1])
-        codon_counts_print = ", ".join(f"{codon}: {float(count) / codon_count * 100:0.4f}%" for codon, count in codon_counts_print)
-        print(f"Codon Distribution Genes: {codon_counts_print}", file=sys.stderr)
-
-        tsv_writer.writerow(row)
+    # rows are written in input order, finished rows wait for the ones before them
+    pending = dict()
+    next_row = 0
+    failed = []
+    for done, (i, row, log, error) in enumerate(analyse_files(args.files, jobs, threads=threads, training_info=training_info, cache=cache, table=args.table, gene_tables=args.gene_tables, cai_weights=cai_weights), 1):
+        file = args.files[i]
+        print(log, end="", file=sys.stderr)
+        if error is None:
+            print(f"[{done}/{len(args.files)}] done {file}", file=sys.stderr)
+        else:
+            print(f"[{done}/{len(args.files)}] failed {file}: {error}", file=sys.stderr)
+            failed.append(file)
+        pending[i] = row
+        while next_row in pending:
+            row = pending.pop(next_row)
+            if row is not None:
+                tsv_writer.writerow(row)
+            next_row += 1
+        sys.stdout.flush()
+
+    if failed:
+        print(f"{len(failed)} of {len(args.files)} files failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == "__main__":
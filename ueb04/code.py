@@ -1,4 +1,10 @@
-# Table 11
+import functools
+
+import numpy as np
+
+import frames
+
+# Table 11 as IUPAC patterns, checked against ncbi_tables below
 code_rev = {
     "F": ["TTY"], # Phenylanalin
     "L": ["TTR", "CTN"], # Leucin
@@ -23,38 +29,195 @@ code_rev = {
     "G": ["GGN"] # Glycin
 }
 
-translation = {
-    "N": "TCAG",
-    "R": "AG",
-    "Y": "TC",
-    "H": "TCA"
-}
-
 def shuffle(s):
     return ''.join([s[1], s[0], s[2]])
 
-def codon_sort_key(codon):
-    table = str.maketrans('TCAG', 'ABCD')
-    return shuffle(codon.translate(table))
-
-def expand_codons(code_rev, translation):
-    code = dict()
-    for aa, patterns in code_rev.items():
-        for pattern in patterns:
-            codons = [pattern]
-            for char, replacements in translation.items():
-                new_codons = []
-                for codon in codons:
-                    if char in codon:
-                        for replacement in replacements:
-                            new_codons.append(codon.replace(char, replacement, 1))
-                    else:
-                        new_codons.append(codon)
-                codons = new_codons
-
-            for codon in codons:
-                code[codon] = aa
-    result = dict(sorted(code.items(), key=lambda x: codon_sort_key(x[0])))
-    return result
-
-code = expand_codons(code_rev, translation)
\ No newline at end of file
+sort_table = str.maketrans('TCAG', 'ABCD')
+
+# codons are sorted by second, first, third base, each in TCAG order
+# only the first three characters are looked at, so "TTT (F)" sorts like TTT,
+# codons with other characters (e.g. ambiguous bases) come after the 64 plain ones
+def codon_sort_key(codon): # -> (int, int | str)
+    try:
+        return (0, codon_rank[codon[:3]])
+    except KeyError:
+        return (1, shuffle(codon.translate(sort_table)))
+
+codon_rank = {c: i for i, c in enumerate(sorted(frames.CODONS, key=lambda c: shuffle(c.translate(sort_table))))}
+# codon indices (frames.CODONS) in sort order, counts[codon_order] sorts an array of 64 counts
+codon_order = np.array([frames.CODONS.index(c) for c in codon_rank])
+
+# the ncbi translation tables, amino acids and starts of the 64 codons in TCAG order (frames.CODONS)
+# as in https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
+# a * in the starts line marks a stop codon that can also be read through
+ncbi_tables = {
+    1: ("Standard",
+        "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "---M------**--*----M---------------M----------------------------"),
+    2: ("Vertebrate Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG",
+        "----------**--------------------MMMM----------**---M------------"),
+    3: ("Yeast Mitochondrial",
+        "FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**----------------------MM---------------M------------"),
+    4: ("Mold, Protozoan, and Coelenterate Mitochondrial and Mycoplasma/Spiroplasma",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--MM------**-------M------------MMMM---------------M------------"),
+    5: ("Invertebrate Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG",
+        "---M------**--------------------MMMM---------------M------------"),
+    6: ("Ciliate, Dasycladacean and Hexamita Nuclear",
+        "FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--------------*--------------------M----------------------------"),
+    9: ("Echinoderm and Flatworm Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+        "----------**-----------------------M---------------M------------"),
+    10: ("Euplotid Nuclear",
+        "FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**-----------------------M----------------------------"),
+    11: ("Bacterial, Archaeal and Plant Plastid",
+        "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "---M------**--*----M------------MMMM---------------M------------"),
+    12: ("Alternative Yeast Nuclear",
+        "FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**--*----M---------------M----------------------------"),
+    13: ("Ascidian Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG",
+        "---M------**----------------------MM---------------M------------"),
+    14: ("Alternative Flatworm Mitochondrial",
+        "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+        "-----------*-----------------------M----------------------------"),
+    16: ("Chlorophycean Mitochondrial",
+        "FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------*---*--------------------M----------------------------"),
+    21: ("Trematode Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+        "----------**-----------------------M---------------M------------"),
+    22: ("Scenedesmus obliquus Mitochondrial",
+        "FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "------*---*---*--------------------M----------------------------"),
+    23: ("Thraustochytrium Mitochondrial",
+        "FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--*-------**--*-----------------M--M---------------M------------"),
+    24: ("Rhabdopleuridae Mitochondrial",
+        "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+        "---M------**-------M---------------M---------------M------------"),
+    25: ("Candidate Division SR1 and Gracilibacteria",
+        "FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "---M------**-----------------------M---------------M------------"),
+    26: ("Pachysolen tannophilus Nuclear",
+        "FFLLSSSSYY**CC*WLLLAPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**--*----M---------------M----------------------------"),
+    27: ("Karyorelict Nuclear",
+        "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--------------*--------------------M----------------------------"),
+    28: ("Condylostoma Nuclear",
+        "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**--*--------------------M----------------------------"),
+    29: ("Mesodinium Nuclear",
+        "FFLLSSSSYYYYCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--------------*--------------------M----------------------------"),
+    30: ("Peritrich Nuclear",
+        "FFLLSSSSYYEECC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "--------------*--------------------M----------------------------"),
+    31: ("Blastocrithidia Nuclear",
+        "FFLLSSSSYYEECCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "----------**-----------------------M----------------------------"),
+    32: ("Balanophoraceae Plastid",
+        "FFLLSSSSYY*WCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+        "---M------*---*----M------------MMMM---------------M------------"),
+    33: ("Cephalodiscidae Mitochondrial",
+        "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+        "---M-------*-------M---------------M---------------M------------"),
+}
+
+# a compiled translation table
+# code: {codon: aa} in sort order, code_rev: {aa: [codons]}
+# table: the amino acid of every codon index (see frames.CODONS) as an ascii byte,
+# indices 64-255 (frames.AMBIGUOUS) translate to X
+class GeneticCode:
+    def __init__(self, id, name, amino_acids, starts):
+        self.id = id
+        self.name = name
+        self.code = dict(sorted(zip(frames.CODONS, amino_acids), key=lambda x: codon_sort_key(x[0])))
+        self.code_rev = dict()
+        for codon, aa in self.code.items():
+            self.code_rev.setdefault(aa, []).append(codon)
+        self.table = np.full(256, ord("X"), dtype=np.uint8)
+        self.table[:64] = np.frombuffer(amino_acids.encode('ascii'), dtype=np.uint8)
+        self.start_codons = frozenset(c for c, s in zip(frames.CODONS, starts) if s == "M")
+        self.stop_codons = frozenset(c for c, aa, s in zip(frames.CODONS, amino_acids, starts) if aa == "*" or s == "*")
+        self.is_start = np.zeros(256, dtype=bool)
+        self.is_start[[frames.CODONS.index(c) for c in self.start_codons]] = True
+        self.is_stop = np.zeros(256, dtype=bool)
+        self.is_stop[[frames.CODONS.index(c) for c in self.stop_codons]] = True
+
+    def __repr__(self):
+        return f"GeneticCode({self.id}, {self.name!r})"
+
+    # an ambiguous codon still has a translation if all codons it stands for agree, e.g. CTN is L
+    @functools.lru_cache(maxsize=None)
+    def translate_ambiguous(self, codon): # str -> str
+        options = set()
+        for a in iupac.get(codon[0], ""):
+            for b in iupac.get(codon[1], ""):
+                for c in iupac.get(codon[2], ""):
+                    options.add(self.code[a + b + c])
+        return options.pop() if len(options) == 1 else "X"
+
+# tables are compiled on first use
+@functools.lru_cache(maxsize=None)
+def get_code(table=11): # -> GeneticCode
+    if isinstance(table, GeneticCode):
+        return table
+    try:
+        name, amino_acids, starts = ncbi_tables[int(table)]
+    except KeyError:
+        raise ValueError(f"unknown translation table {table}, known are {', '.join(map(str, ncbi_tables))}") from None
+    return GeneticCode(int(table), name, amino_acids, starts)
+
+code = get_code(11).code
+code_table = get_code(11).table
+
+iupac = {
+    "A": "A", "C": "C", "G": "G", "T": "T", "U": "T",
+    "R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT", "M": "AC",
+    "B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT"
+}
+
+# the hand written patterns and the ncbi string of table 11 have to agree
+assert code == {
+    a + b + c: aa
+    for aa, patterns in code_rev.items() for pattern in patterns
+    for a in iupac[pattern[0]] for b in iupac[pattern[1]] for c in iupac[pattern[2]]
+}, "table 11 does not match code_rev"
+
+def translate_ambiguous(codon, table=11): # str -> str
+    return get_code(table).translate_ambiguous(codon)
+
+def translate_codons(indices, table=11): # np.array(uint8) of codon indices -> str
+    return get_code(table).table[indices].tobytes().decode('ascii')
+
+complement_table = str.maketrans("ACGTRYSWKMBDHVNacgtryswkmbdhvn", "TGCAYRSWMKVHDBNtgcayrswmkvhdbn")
+
+# translate the sequence in the frame starting at offset, trailing bases are ignored
+def translate(sequence, offset=0, table=11): # str | bytes-like -> str
+    genetic_code = get_code(table)
+    indices = frames.frame_index(sequence, offset)
+    protein = genetic_code.table[indices]
+    ambiguous = np.flatnonzero(indices == frames.AMBIGUOUS)
+    if len(ambiguous):
+        if not isinstance(sequence, str):
+            sequence = bytes(sequence).decode('ascii')
+        for i in ambiguous.tolist():
+            start = offset + 3*i
+            protein[i] = ord(genetic_code.translate_ambiguous(sequence[start:start+3].upper()))
+    return protein.tobytes().decode('ascii')
+
+# translations of the six frames in the order of frames.frames
+def translate_frames(sequence, table=11): # -> [str] * 6
+    if not isinstance(sequence, str):
+        sequence = bytes(sequence).decode('ascii')
+    reverse = sequence.translate(complement_table)[::-1]
+    length = len(sequence)
+    return [translate(sequence, f, table) for f in range(3)] + [translate(reverse, (length - f) % 3, table) for f in range(3)]
@@ -0,0 +1,112 @@
+# codon usage bias per gene: RSCU, CAI and ENC
+# everything works on count matrices of shape (genes, 64), columns are codon indices (frames.CODONS)
+import csv
+
+import numpy as np
+
+import code
+import frames
+
+# codon counts of every gene, genes are (begin, end, strand) on sequence in 1-based inclusive coordinates
+def gene_count_matrix(sequence, begins, ends, strands): # -> (genes, 64)
+    gene, codons = frames.gene_codons(sequence, begins, ends, strands)
+    valid = codons < 64
+    counts = np.bincount(gene[valid] * 64 + codons[valid], minlength=len(begins) * 64)
+    return counts.reshape(len(begins), 64)
+
+# codon counts of every sequence, read in the first frame
+def count_matrix(sequences): # -> (sequences, 64)
+    codons = [frames.frame_index(s) for s in sequences]
+    gene = np.repeat(np.arange(len(codons)), [len(c) for c in codons])
+    codons = np.concatenate(codons) if codons else np.zeros(0, dtype=np.uint8)
+    valid = codons < 64
+    counts = np.bincount(gene[valid] * 64 + codons[valid], minlength=len(sequences) * 64)
+    return counts.reshape(len(sequences), 64)
+
+# synonymous codon families of a translation table
+# amino_acids: the amino acids without stop, family: index into amino_acids for every codon, -1 for stops
+def families(table=11): # -> (str, np.array(int), np.array(int))
+    genetic_code = code.get_code(table)
+    codon_aas = genetic_code.table[:64].tobytes().decode('ascii')
+    amino_acids = "".join(sorted(set(codon_aas) - {"*"}))
+    family = np.array([amino_acids.find(aa) for aa in codon_aas])
+    family[genetic_code.is_stop[:64]] = -1
+    degeneracy = np.bincount(family[family >= 0], minlength=len(amino_acids))
+    return amino_acids, family, degeneracy
+
+# sums of counts (..., 64) over the codons of each amino acid, (..., amino acids)
+def family_sums(counts, family, n):
+    onehot = np.zeros((64, n), dtype=np.int64)
+    sense = np.flatnonzero(family >= 0)
+    onehot[sense, family[sense]] = 1
+    return np.asarray(counts) @ onehot
+
+# relative synonymous codon usage: observed count / count expected if all synonymous codons were used equally
+# codons of amino acids that do not occur and stop codons are 0
+def rscu(counts, table=11): # (..., 64) -> (..., 64)
+    amino_acids, family, degeneracy = families(table)
+    counts = np.asarray(counts, dtype=float)
+    sums = family_sums(counts, family, len(amino_acids))
+    sense = family >= 0
+    expected = np.zeros_like(counts)
+    expected[..., sense] = sums[..., family[sense]] / degeneracy[family[sense]]
+    return np.divide(counts, expected, out=np.zeros_like(counts), where=expected > 0)
+
+# relative adaptiveness w of every codon from the pooled counts of a reference set of (highly expressed) genes
+# codons missing from the reference get a pseudocount of 0.5, as suggested by Sharp and Li
+def relative_adaptiveness(reference_counts, table=11): # (64,) -> (64,)
+    amino_acids, family, degeneracy = families(table)
+    reference_counts = np.asarray(reference_counts, dtype=float).reshape(-1, 64).sum(axis=0)
+    reference_counts = np.where(reference_counts > 0, reference_counts, 0.5)
+    weights = np.zeros(64)
+    for f in range(len(amino_acids)):
+        members = family == f
+        weights[members] = reference_counts[members] / reference_counts[members].max()
+    return weights
+
+# codon adaptation index, the geometric mean of w over the codons of each gene
+# single codon amino acids (M, W) and stop codons are not counted
+def cai(counts, weights, table=11): # (genes, 64) -> (genes,)
+    amino_acids, family, degeneracy = families(table)
+    informative = (family >= 0) & (degeneracy[np.maximum(family, 0)] > 1)
+    counts = np.asarray(counts, dtype=float)[..., informative]
+    total = counts.sum(axis=-1)
+    log_cai = counts @ np.log(weights[informative])
+    return np.exp(np.divide(log_cai, total, out=np.full(np.shape(total), np.nan), where=total > 0))
+
+# effective number of codons (Wright 1990)
+# the homozygosity F of each amino acid is averaged within its degeneracy class k,
+# ENC = sum over classes of (amino acids in class / mean F of class). a missing class
+# is filled with 1/k (uniform usage), the result is at most the number of sense codons
+def enc(counts, table=11): # (genes, 64) -> (genes,)
+    amino_acids, family, degeneracy = families(table)
+    counts = np.asarray(counts, dtype=float)
+    n = family_sums(counts, family, len(amino_acids))
+    squares = family_sums(counts ** 2, family, len(amino_acids))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # F = (n * sum(p^2) - 1) / (n - 1) with p = count / n
+        homozygosity = (squares / n - 1) / (n - 1)
+    homozygosity[n < 2] = np.nan
+    result = np.zeros(counts.shape[:-1])
+    for k in np.unique(degeneracy):
+        members = degeneracy == k
+        if k == 1:
+            result += members.sum()
+            continue
+        f = homozygosity[..., members]
+        valid = ~np.isnan(f)
+        mean = np.divide(np.nansum(f, axis=-1), valid.sum(axis=-1), out=np.full(result.shape, 1 / k), where=valid.any(axis=-1))
+        result += members.sum() / np.maximum(mean, 1e-9)
+    result = np.minimum(result, (family >= 0).sum())
+    result[counts.sum(axis=-1) == 0] = np.nan
+    return result
+
+# per gene table: coordinates, gc, cai, enc and the rscu of every codon in code.codon_order
+def write_gene_table(output_file, genes, counts, gc, weights, table=11):
+    writer = csv.writer(output_file, delimiter="\t")
+    writer.writerow(["contig", "begin", "end", "strand", "start_type", "gc", "cai", "enc", *(frames.CODONS[i] for i in code.codon_order)])
+    gene_cai = cai(counts, weights, table)
+    gene_enc = enc(counts, table)
+    gene_rscu = rscu(counts, table)[:, code.codon_order]
+    for (contig, begin, end, strand, start_type), *values in zip(genes, gc.tolist(), gene_cai.tolist(), gene_enc.tolist(), gene_rscu.round(4).tolist()):
+        writer.writerow([contig, begin, end, "+" if strand == 1 else "-", start_type, *values[:3], *values[3]])
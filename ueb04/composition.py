@@ -0,0 +1,126 @@
+# nucleotide composition with numpy
+# sequences are counted as raw bytes with a single bincount,
+# then folded onto the IUPAC alphabet. lowercase (soft-masked) bases count
+# as their uppercase base, U counts as T. anything else ends up in OTHER
+import numpy as np
+
+ALPHABET = "ACGTRYSWKMBDHVN-"
+OTHER = len(ALPHABET) # index of the catch-all column
+A, C, G, T = range(4)
+S = ALPHABET.index("S") # G or C, counts as gc
+N = ALPHABET.index("N")
+
+def _fold_table():
+    table = np.full(256, OTHER, dtype=np.uint8)
+    for i, base in enumerate(ALPHABET):
+        table[ord(base)] = i
+        table[ord(base.lower())] = i
+    table[ord("U")] = table[ord("u")] = T
+    return table
+
+fold_table = _fold_table()
+# one-hot (256, len(ALPHABET) + 1), folding byte counts is a matrix product
+fold_matrix = np.eye(OTHER + 1, dtype=np.int64)[fold_table]
+
+def encode(sequence): # str | bytes-like | PackedSequence -> np.array(uint8)
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    elif hasattr(sequence, 'encoded'): # packed.PackedSequence
+        sequence = bytes(sequence)
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+# bincount works on 8 byte integers, so sequences are counted in blocks of this many bytes
+BLOCK = 2**22
+
+# counts of every byte value, shape (256,)
+def byte_counts(sequence):
+    data = encode(sequence)
+    counts = np.zeros(256, dtype=np.int64)
+    for i in range(0, len(data), BLOCK):
+        counts += np.bincount(data[i:i+BLOCK], minlength=256)
+    return counts
+
+# fold byte counts (..., 256) onto the alphabet (..., len(ALPHABET) + 1)
+def fold(counts):
+    return np.asarray(counts, dtype=np.int64) @ fold_matrix
+
+# number of soft-masked (lowercase) bases in byte counts (..., 256)
+def masked(counts):
+    return np.asarray(counts)[..., ord('a'):ord('z')+1].sum(axis=-1)
+
+def composition(sequence): # -> {base: count}
+    counts = fold(byte_counts(sequence))
+    return dict(zip(ALPHABET + "?", counts.tolist()))
+
+# gc fraction of folded counts (..., len(ALPHABET) + 1), relative to the full length
+def gc_fraction(folded):
+    folded = np.asarray(folded)
+    total = folded.sum(axis=-1)
+    gc = folded[..., G] + folded[..., C] + folded[..., S]
+    return np.divide(gc, total, out=np.zeros(np.shape(total)), where=total != 0)
+
+def gc_content(sequence):
+    return float(gc_fraction(fold(byte_counts(sequence))))
+
+# byte counts of short sequences with one bincount, every sequence gets its own 256 values
+def _batch_byte_counts(sequences):
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    data = np.concatenate(sequences).astype(np.int64)
+    data += np.repeat(np.arange(len(sequences), dtype=np.int64) * 256, lengths)
+    return np.bincount(data, minlength=len(sequences) * 256).reshape(-1, 256)
+
+# yields (rows, byte counts of these rows) for many sequences
+# short sequences are counted together in batches of about BLOCK bytes, long ones on their own,
+# so the temporary memory does not depend on the input size
+def _byte_count_batches(sequences):
+    batch = []
+    size = 0
+    for i, sequence in enumerate(sequences):
+        if len(sequence) > BLOCK:
+            yield [i], byte_counts(sequence)[None, :]
+            continue
+        batch.append((i, sequence))
+        size += len(sequence)
+        if size >= BLOCK:
+            yield [j for j, _ in batch], _batch_byte_counts([s for _, s in batch])
+            batch = []
+            size = 0
+    if batch:
+        yield [j for j, _ in batch], _batch_byte_counts([s for _, s in batch])
+
+# byte counts for many sequences at once, shape (len(sequences), 256)
+def byte_count_matrix(sequences):
+    sequences = [encode(s) for s in sequences]
+    counts = np.zeros((len(sequences), 256), dtype=np.int64)
+    for rows, batch_counts in _byte_count_batches(sequences):
+        counts[rows] = batch_counts
+    return counts
+
+# folded counts for many sequences, shape (len(sequences), len(ALPHABET) + 1)
+# every batch is folded on its own, the byte counts of all sequences are never kept
+def composition_matrix(sequences):
+    sequences = [encode(s) for s in sequences]
+    counts = np.zeros((len(sequences), OTHER + 1), dtype=np.int64)
+    for rows, batch_counts in _byte_count_batches(sequences):
+        counts[rows] = fold(batch_counts)
+    return counts
+
+def gc_contents(sequences):
+    return gc_fraction(composition_matrix(sequences))
+
+# folded counts of the intervals [begins, ends) of one sequence,
+# shape (len(begins), len(ALPHABET) + 1). intervals may overlap.
+# uses one prefix sum per base class that actually occurs in the sequence
+def interval_composition(sequence, begins, ends):
+    classes = fold_table[encode(sequence)]
+    begins = np.asarray(begins, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    result = np.zeros((len(begins), OTHER + 1), dtype=np.int64)
+    prefix = np.zeros(len(classes) + 1, dtype=np.int64)
+    for c in np.unique(classes):
+        np.cumsum(classes == c, out=prefix[1:])
+        result[:, c] = prefix[ends] - prefix[begins]
+    return result
+
+def interval_gc(sequence, begins, ends):
+    return gc_fraction(interval_composition(sequence, begins, ends))
@@ -1,89 +1,211 @@
 # compare getorf output with prodigal output
-# write file with prodigal id and getorf id, write - if not found
+# write file with getorf id and prodigal id, write @ if not found
 # a gene is identified by start, stop, and read direction
 # getorf writes [start - stop] regardless of read direction, if start > stop the gene is on the complementary strand
 
 # call getorf as $ getorf -sequence file.fna -outseq file.getorf -table 11 -find 3
 # call prodigal as $ prodigal -i file.fna -f gff -o file.gff -d nuc_file
+# find_frames.py writes both formats as well
+
+# both files are streamed, only the coordinates are kept. the getorf orfs of every contig and strand
+# are indexed by sorted stops and sorted lower coordinates, so each prodigal gene is matched with
+# a binary search: matched if start and stop are within the tolerance, partial if it only overlaps
+# in the same frame (same stop with another start or shifted stop) by at least min_overlap of the shorter one
 import argparse
+import sys
 from collections import defaultdict
 
-def main():
-    global result
-    parser = argparse.ArgumentParser(
-        prog='diff',
-        description='compare reading frames'
-    )
-    parser.add_argument('getorf_file', help="output of getorf")
-    parser.add_argument('gff_file', help="output of prodigal")
-    args = parser.parse_args()
+import numpy as np
 
-    # getorf header format: 
-    # >ID [start - end] other info
-    getorf = dict()
-    with open(args.getorf_file) as f:
-        for i, line in enumerate(f.readlines()):
+# getorf header format:
+# >ID [start - end] other info
+# yields (contig, id, start, stop, dir) with the stop codon included, like prodigal
+def read_getorf(file_path):
+    with open(file_path) as f:
+        for line in f:
             if line[0] != ">": # only look at header lines
                 continue
             id, begin, _, end, *_ = line.split(" ")
             id = id[1:]
             begin = int(begin[1:])
-            end = int(end[:-1])
-            dir = 1
+            end = int(end.rstrip()[:-1])
+            # getorf does not output the stop codon, prodigal does
             if begin > end:
-                end, begin = begin, end
-                dir = -1
-                begin -= 3 # getorf does not output the stop codon, prodigal does
+                yield id.rsplit("_", 1)[0], id, begin, end - 3, -1
             else:
-                end += 3
-            start, stop = begin, end
-            getorf[(stop, dir)] = (id, start, stop)
-            # print(f"{id}\t{begin}\t{end}\t{' +-'[dir]}")
-            """
-            print((id, start, stop, dir))
-            if i > 10:
-                return
-            """
-
-    prodigal = dict()
-    with open(args.gff_file) as f:
-        for i, line in enumerate(f.readlines()):
-            if line[0] == '#': # skip comment lines
+                yield id.rsplit("_", 1)[0], id, begin, end + 3, 1
+
+# yields (contig, id, start, stop, dir) of the CDS features of a gff file
+def read_gff(file_path):
+    with open(file_path) as f:
+        for line in f:
+            if line[0] == '#' or not line.strip(): # skip comment lines
                 continue
-            genome_id, _, _, begin, end, _, dir, _, notes = line.split("\t")
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 9 or fields[2] != "CDS":
+                continue
+            genome_id, _, _, begin, end, _, dir, _, notes = fields
             gene_id, *_ = notes.split(";")
-
-
             id = genome_id + "/" + gene_id[3:]
             begin = int(begin)
             end = int(end)
             if dir == "+":
-                start, stop = begin, end
+                yield genome_id, id, begin, end, 1
             else:
-                start, stop = end, begin
-            dir += "1"
-            dir = int(dir)
-
-            prodigal[(stop, dir)] = (id, start, stop)
-            print(f"{id}\t{begin}\t{end}\t{' +-'[dir]}")
-        return
-
-    merged = defaultdict(dict)
-    for k,v in getorf.items():
-        merged[k]["getorf"] = v
-    for k,v in prodigal.items():
-        merged[k]["prodigal"] = v
-
-    result = list()
-    for i, (k, v) in enumerate(merged.items()):
-        _, dir = k
-        getorf_id, start_g, stop_g = v.get("getorf", ("@", -1, -1))
-        prodigal_id, start_p, stop_p = v.get("prodigal", ("@", -1, -1))
-
-        print(f"{getorf_id}\t{prodigal_id}\t{' +-'[dir]}\t{start_g}\t{stop_g}\t{start_p}\t{stop_p}")
-        #print(f"{getorf_id}\t{prodigal_id}\t{begin}\t{end}\t{' +-'[dir]}\t{start_g}\t{stop_g}\t{start_p}\t{stop_p}")
-        #print(f"{getorf_id}\t{prodigal_id}\t{start_g if start_g != -1 else start_p}\t{stop}\t{' +-'[dir]}")
-        #result.append((getorf_id, prodigal_id, start_g, start_p, stop, dir))
+                yield genome_id, id, end, begin, -1
+
+# predictions on one contig and strand
+# sorted by stop for tolerance matches and by the lower coordinate in classes of similar length for overlaps
+class IntervalIndex:
+    def __init__(self, ids, starts, stops):
+        self.ids = ids
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.stops = np.asarray(stops, dtype=np.int64)
+        self.lows = np.minimum(self.starts, self.stops)
+        self.highs = np.maximum(self.starts, self.stops)
+        self.by_stop = np.argsort(self.stops, kind='stable')
+        self.sorted_stops = self.stops[self.by_stop]
+        by_low = np.argsort(self.lows, kind='stable')
+        # position of every interval in the order of lows, overlaps are reported in this order
+        self.low_rank = np.empty(len(ids), dtype=np.int64)
+        self.low_rank[by_low] = np.arange(len(ids))
+        # classes of similar length, 2^(c-1) <= length < 2^c, as (indices sorted by low, their lows, longest length).
+        # an overlap of [low, high] begins at most the longest length of its class before low, so a
+        # long orf only widens the search in its own class and not for all the short ones
+        lengths = self.highs - self.lows + 1
+        classes = np.frexp(lengths.astype(np.float64))[1]
+        self.classes = []
+        for c in np.unique(classes):
+            members = by_low[classes[by_low] == c]
+            self.classes.append((members, self.lows[members], int(lengths[members].max())))
+        self.used = np.zeros(len(ids), dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # indices of the intervals with a stop within tolerance of stop
+    def same_stop(self, stop, tolerance=0):
+        lo = np.searchsorted(self.sorted_stops, stop - tolerance, side='left')
+        hi = np.searchsorted(self.sorted_stops, stop + tolerance, side='right')
+        return self.by_stop[lo:hi]
+
+    # indices of the intervals overlapping [low, high] and the number of shared bases
+    # only intervals of a class that begin within its longest length before low are looked at,
+    # orfs of one frame don't overlap, so few of these miss [low, high] however long other orfs are
+    def overlapping(self, low, high):
+        parts = [np.zeros(0, dtype=np.int64)]
+        for members, lows, max_length in self.classes:
+            lo = np.searchsorted(lows, low - max_length + 1, side='left')
+            hi = np.searchsorted(lows, high, side='right')
+            parts.append(members[lo:hi])
+        candidates = np.concatenate(parts)
+        candidates = candidates[np.argsort(self.low_rank[candidates])]
+        overlap = np.minimum(self.highs[candidates], high) - np.maximum(self.lows[candidates], low) + 1
+        return candidates[overlap > 0], overlap[overlap > 0]
+
+# index all predictions by (contig, dir)
+def build_indices(records): # -> {(contig, dir): IntervalIndex}
+    groups = defaultdict(lambda: ([], [], []))
+    for contig, id, start, stop, dir in records:
+        ids, starts, stops = groups[(contig, dir)]
+        ids.append(id)
+        starts.append(start)
+        stops.append(stop)
+    return {key: IntervalIndex(*group) for key, group in groups.items()}
+
+# best match of a gene among the orfs of an index that are not used yet: (status, index of the match, overlap fraction)
+# status is matched, partial or unique, with exact_only only matched or unique
+def match(index, start, stop, tolerance=0, min_overlap=0.5, exact_only=False):
+    low, high = min(start, stop), max(start, stop)
+    candidates = index.same_stop(stop, tolerance)
+    candidates = candidates[~index.used[candidates]]
+    if len(candidates):
+        # the orf with the closest start, getorf reports the longest orf for each stop
+        best = candidates[np.argmin(np.abs(index.starts[candidates] - start))]
+        if abs(index.starts[best] - start) <= tolerance:
+            return "matched", best, 1.0
+        overlap = min(index.highs[best], high) - max(index.lows[best], low) + 1
+        shorter = min(index.highs[best] - index.lows[best], high - low) + 1
+        if not exact_only and overlap / shorter >= min_overlap:
+            return "partial", best, float(overlap / shorter)
+    if exact_only:
+        return "unique", None, 0.0
+    candidates, overlap = index.overlapping(low, high)
+    # only unused overlaps in the same frame
+    keep = ~index.used[candidates] & ((index.stops[candidates] - stop) % 3 == 0)
+    candidates, overlap = candidates[keep], overlap[keep]
+    if len(candidates):
+        shorter = np.minimum(index.highs[candidates] - index.lows[candidates], high - low) + 1
+        fraction = overlap / shorter
+        best = np.argmax(fraction)
+        if fraction[best] >= min_overlap:
+            return "partial", candidates[best], float(fraction[best])
+    return "unique", None, 0.0
+
+# indices are the getorf orfs from build_indices
+# yields (status, getorf_id, prodigal_id, dir, start_g, stop_g, start_p, stop_p, overlap) for every prodigal gene
+# and afterwards for every getorf orf that was not matched, @ and -1 mark a missing side
+# every orf is matched to at most one gene: exact matches are assigned first, so a partial
+# match never takes the orf of an exact one, then the remaining genes in file order
+def compare(indices, prodigal_records, tolerance=0, min_overlap=0.5):
+    empty = IntervalIndex([], [], [])
+    records = list(prodigal_records)
+    results = [None] * len(records)
+    for exact_only in (True, False):
+        for n, (contig, prodigal_id, start_p, stop_p, dir) in enumerate(records):
+            if results[n] is not None:
+                continue
+            index = indices.get((contig, dir), empty)
+            status, i, overlap = match(index, start_p, stop_p, tolerance, min_overlap, exact_only)
+            if i is not None:
+                index.used[i] = True
+                results[n] = (status, index, i, overlap)
+    for (contig, prodigal_id, start_p, stop_p, dir), result in zip(records, results):
+        if result is None:
+            yield "prodigal_only", "@", prodigal_id, dir, -1, -1, start_p, stop_p, 0.0
+            continue
+        status, index, i, overlap = result
+        yield status, index.ids[i], prodigal_id, dir, int(index.starts[i]), int(index.stops[i]), start_p, stop_p, overlap
+    for (contig, dir), index in indices.items():
+        for i in np.flatnonzero(~index.used).tolist():
+            yield "getorf_only", index.ids[i], "@", dir, int(index.starts[i]), int(index.stops[i]), -1, -1, 0.0
+
+# shares of matched, partial and prodigal_only are of all prodigal genes, getorf_only of all getorf orfs
+def print_summary(counts, getorf, start_differences, file=sys.stderr):
+    prodigal = counts["matched"] + counts["partial"] + counts["prodigal_only"]
+    print(f"prodigal genes\t{prodigal}", file=file)
+    print(f"getorf orfs\t{getorf}", file=file)
+    for status, total in (("matched", prodigal), ("partial", prodigal), ("prodigal_only", prodigal), ("getorf_only", getorf)):
+        print(f"{status}\t{counts[status]}\t{counts[status] / max(total, 1):.2%}", file=file)
+    if start_differences:
+        differences = np.abs(start_differences)
+        print(f"partial start difference\tmedian {np.median(differences):.0f}\tmean {differences.mean():.1f}", file=file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='diff',
+        description='compare reading frames'
+    )
+    parser.add_argument('getorf_file', help="output of getorf")
+    parser.add_argument('gff_file', help="output of prodigal")
+    parser.add_argument('-t', '--tolerance', type=int, default=0, help="start and stop may differ by this many bases for a match, default 0")
+    parser.add_argument('-m', '--min-overlap', type=float, default=0.5, help="overlap as fraction of the shorter call for a partial match, default 0.5")
+    parser.add_argument('--summary', action='store_true', help="only print the summary")
+    args = parser.parse_args()
+
+    indices = build_indices(read_getorf(args.getorf_file))
+    counts = defaultdict(int)
+    start_differences = list()
+    if not args.summary:
+        print("status\tgetorf\tprodigal\tdir\tstart_g\tstop_g\tstart_p\tstop_p\toverlap")
+    rows = compare(indices, read_gff(args.gff_file), args.tolerance, args.min_overlap)
+    for status, getorf_id, prodigal_id, dir, start_g, stop_g, start_p, stop_p, overlap in rows:
+        counts[status] += 1
+        if status == "partial":
+            start_differences.append(start_g - start_p)
+        if not args.summary:
+            print(f"{status}\t{getorf_id}\t{prodigal_id}\t{' +-'[dir]}\t{start_g}\t{stop_g}\t{start_p}\t{stop_p}\t{overlap:.3f}")
+    print_summary(counts, sum(len(index) for index in indices.values()), start_differences)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
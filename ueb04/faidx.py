@@ -0,0 +1,165 @@
+# samtools compatible fasta index (.fai)
+# each line of the index is: name, length, offset, linebases, linewidth
+# offset is the byte offset of the first base, linebases the number of bases per line
+# and linewidth the number of bytes per line including the line break
+import argparse
+import os
+import os.path
+import re
+
+import fasta
+
+def index_record(buf, begin, end): # -> (length, linebases, linewidth)
+    record = bytes(memoryview(buf)[begin:end])
+    data = record.rstrip(b'\r\n')
+    if not data:
+        return 0, 0, 0
+    first = data.find(b'\n')
+    if first == -1:
+        # the line break is \r\n or \n, a missing one at the end of the file counts as \n
+        return len(data), len(data), len(data) + (2 if record[len(data):len(data)+2] == b'\r\n' else 1)
+    linewidth = first + 1
+    linebases = first - 1 if data[first-1:first] == b'\r' else first
+    breaks = data.count(b'\n')
+    last = len(data) - breaks * linewidth
+    # every line but the last has to be exactly linewidth bytes long
+    if data[linewidth-1::linewidth] != b'\n' * breaks or not 0 < last <= linebases:
+        raise ValueError("different line length in sequence")
+    return breaks * linebases + last, linebases, linewidth
+
+def build_index(fasta_path): # -> {name: (length, offset, linebases, linewidth)}
+    buf = fasta.open_buffer(fasta_path)
+    index = dict()
+    for header, begin, end in fasta.record_spans(buf):
+        name = fasta.record_id(header)
+        try:
+            length, linebases, linewidth = index_record(buf, begin, end)
+        except ValueError as e:
+            raise ValueError(f"{fasta_path}: {name}: {e}") from None
+        if name in index:
+            raise ValueError(f"{fasta_path}: duplicate sequence name {name}")
+        index[name] = (length, begin, linebases, linewidth)
+    return index
+
+def read_fai(fai_path):
+    index = dict()
+    with open(fai_path) as f:
+        for line in f:
+            name, *fields = line.rstrip("\n").split("\t")
+            index[name] = tuple(int(field) for field in fields[:4])
+    return index
+
+def write_fai(fai_path, index):
+    with open(fai_path, "w") as f:
+        for name, fields in index.items():
+            print(name, *fields, sep="\t", file=f)
+
+# use the .fai next to the fasta file if it is up to date, otherwise (re)build it
+def load_index(fasta_path):
+    fai_path = fasta_path + ".fai"
+    try:
+        if os.path.getmtime(fai_path) >= os.path.getmtime(fasta_path):
+            return read_fai(fai_path)
+    except OSError:
+        pass
+    index = build_index(fasta_path)
+    try:
+        write_fai(fai_path, index)
+    except OSError:
+        pass # read only directory, keep the index in memory
+    return index
+
+# samtools style region: name, name:begin or name:begin-end, 1-based and inclusive
+# returns name and 0-based, half open coordinates, None means open ended
+def parse_region(region): # str -> (str, int | None, int | None)
+    match = re.fullmatch(r"(.+?)(?::([\d,]+)(?:-([\d,]+))?)?", region.strip())
+    name, begin, end = match.groups()
+    begin = int(begin.replace(",", "")) - 1 if begin else None
+    end = int(end.replace(",", "")) if end else None
+    return name, begin, end
+
+# byte offsets [first, last) in the file that hold bases [start, end) of a sequence
+def byte_range(offset, linebases, linewidth, start, end): # -> (int, int)
+    first = offset + start // linebases * linewidth + start % linebases
+    last = offset + end // linebases * linewidth + end % linebases
+    return first, last
+
+class IndexedFasta:
+    def __init__(self, fasta_path):
+        self.index = load_index(fasta_path)
+        self.file = open(fasta_path, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return list(self.index)
+
+    def length(self, name):
+        return self.index[name][0]
+
+    # the header line of sequence name without the '>', it ends right before the first base
+    def header(self, name): # -> str
+        try:
+            offset = self.index[name][1]
+        except KeyError:
+            raise KeyError(f"sequence {name} not in index") from None
+        size = 256
+        while True:
+            first = max(0, offset - size)
+            self.file.seek(first)
+            data = self.file.read(offset - first)
+            # the header has no line break, so its '>' is the last one at the start of a line
+            start = data.rfind(b'\n>')
+            if start != -1 or first == 0:
+                return data[start+2 if start != -1 else 1:].rstrip(b'\r\n').decode()
+            size *= 4
+
+    # read bases [start, end) of sequence name, only touches the bytes of the region
+    def fetch(self, name, start=None, end=None, binary=False):
+        try:
+            length, offset, linebases, linewidth = self.index[name]
+        except KeyError:
+            raise KeyError(f"sequence {name} not in index") from None
+        start = 0 if start is None else max(0, min(start, length))
+        end = length if end is None else max(start, min(end, length))
+        if start == end:
+            return b"" if binary else ""
+        first, last = byte_range(offset, linebases, linewidth, start, end)
+        self.file.seek(first)
+        data = self.file.read(last - first).translate(None, b'\r\n')
+        return data if binary else data.decode('ascii')
+
+    def fetch_region(self, region, binary=False):
+        return self.fetch(*parse_region(region), binary=binary)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='faidx.py',
+        description='index a fasta file and print regions of it'
+    )
+    parser.add_argument('fasta_file', help="fasta file, the index is written next to it")
+    parser.add_argument('regions', nargs='*', help="regions to print, name[:begin[-end]] 1-based inclusive")
+    args = parser.parse_args()
+
+    with IndexedFasta(args.fasta_file) as fa:
+        for region in args.regions:
+            print(">" + region)
+            sequence = fa.fetch_region(region)
+            for i in range(0, len(sequence), 60):
+                print(sequence[i:i+60])
+
+if __name__ == "__main__":
+    main()
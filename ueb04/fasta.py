@@ -1,15 +1,70 @@
-def read_fasta(file_path):
-  with open(file_path, 'r') as file:
-    sequences = {None: ""}
-    header = None
-    for line in file:
-      line = line.strip()
-      if line[0] == ">":
-        header = line[1:].split(" ")[0] # remove > and only take the id (until first space)
-        sequences[header] = ""
-      else:
-        sequences[header] += line
-  if len(sequences[None]) != 0:
-    print("Warning: sequence without header")
-  del sequences[None]
-  return sequences
\ No newline at end of file
+import mmap
+import sys
+
+# characters that are dropped from sequence lines
+whitespace = b' \t\r\n'
+whitespace_bytes = tuple(bytes([c]) for c in whitespace)
+
+def open_buffer(file_path):
+  # map the file into memory, this fails for pipes and empty files,
+  # in that case just read everything
+  with open(file_path, 'rb') as file:
+    try:
+      return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+      return file.read()
+
+# yields (header, begin, end) for every record in buf,
+# header is the full header line without the '>'
+# begin and end are the byte offsets of the sequence lines
+def record_spans(buf):
+  pos = 0
+  size = len(buf)
+  if size and buf[0:1] != b'>':
+    pos = buf.find(b'\n>')
+    pos = size if pos == -1 else pos + 1
+    if bytes(buf[0:pos]).strip(whitespace):
+      print("Warning: sequence without header", file=sys.stderr)
+  while pos < size:
+    header_end = buf.find(b'\n', pos)
+    if header_end == -1:
+      header_end = size
+    header = bytes(buf[pos+1:header_end]).rstrip(b'\r').decode()
+    begin = min(header_end + 1, size)
+    end = buf.find(b'\n>', header_end)
+    end = size if end == -1 else end + 1
+    yield header, begin, end
+    pos = end
+
+# the sequence between begin and end with all line breaks removed
+# if the sequence is on a single line a zero-copy memoryview is returned
+def sequence_bytes(buf, begin, end):
+  # trim whitespace around the sequence, that doesn't need a copy
+  while end > begin and buf[end-1:end] in whitespace_bytes:
+    end -= 1
+  while begin < end and buf[begin:begin+1] in whitespace_bytes:
+    begin += 1
+  view = memoryview(buf)[begin:end]
+  if all(buf.find(c, begin, end) == -1 for c in whitespace_bytes):
+    return view
+  return bytes(view).translate(None, whitespace)
+
+# the id of a header line, like samtools everything until the first space or tab
+def record_id(header):
+  return header.split(" ", 1)[0].split("\t", 1)[0]
+
+# lazily iterate over all records in a fasta file
+# yields (id, sequence), id is the header until the first space or tab
+# sequence is bytes-like if binary is set, str otherwise
+def iter_fasta(file_path, binary=False, full_header=False):
+  buf = open_buffer(file_path)
+  for header, begin, end in record_spans(buf):
+    if not full_header:
+      header = record_id(header)
+    sequence = sequence_bytes(buf, begin, end)
+    if not binary:
+      sequence = str(sequence, 'ascii')
+    yield header, sequence
+
+def read_fasta(file_path, binary=False):
+  return dict(iter_fasta(file_path, binary))
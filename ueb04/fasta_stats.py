@@ -1,28 +1,17 @@
-from code import code, codon_sort_key
+from code import get_code, codon_sort_key
+from fasta import read_fasta, iter_fasta
+from faidx import IndexedFasta
+import composition
+import frames
+import kmers
+from quantiles import KLL
 
 import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 
-def read_fasta(file_path):
-  with open(file_path, 'r') as file:
-    sequences = {None: ""}
-    header = None
-    for line in file:
-      line = line.strip()
-      if line[0] == ">":
-        header = line[1:].split(" ")[0] # remove > and only take the id (until first space)
-        sequences[header] = ""
-      else:
-        sequences[header] += line
-  if len(sequences[None]) != 0:
-    print("Warning: sequence without header")
-  del sequences[None]
-  return sequences
-
 def calculate_gc_content(sequence):
-  gc_count = sum(1 for nt in sequence if nt in ['G', 'C'])
-  return (gc_count / len(sequence)) * 100 if sequence else 0
+  return composition.gc_content(sequence) * 100
 
 def print_fasta_statistics(fasta_dict):
   sequence_lengths = [len(seq) for seq in fasta_dict.values()]
@@ -44,10 +33,11 @@ def print_fasta_statistics(fasta_dict):
   print(f"Max sequence size: {max_size}")
 
   # GC content
-  combined_gc_content = calculate_gc_content(''.join(fasta_dict.values()))
+  counts = composition.composition_matrix(fasta_dict.values())
+  combined_gc_content = composition.gc_fraction(counts.sum(axis=0)) * 100
   print(f"GC content of all sequences combined: {combined_gc_content:.2f}%")
 
-  individual_gc_contents = [calculate_gc_content(seq) for seq in fasta_dict.values()]
+  individual_gc_contents = list(composition.gc_fraction(counts) * 100)
   min_gc = min(individual_gc_contents)
   max_gc = max(individual_gc_contents)
   quartiles_gc = np.percentile(individual_gc_contents, [25, 50, 75])
@@ -57,6 +47,78 @@ def print_fasta_statistics(fasta_dict):
 
   return sequence_lengths, individual_gc_contents
 
+# the statistics of print_fasta_statistics in one pass and constant memory
+# count, total size, base counts and min/max are exact, the quartiles come from KLL sketches.
+# states of shards of the input can be saved and merged, the result is the same as for the whole input
+# (up to the error of the quartiles)
+class StreamingStats:
+  def __init__(self, k=200):
+    self.count = 0
+    self.total = 0
+    self.counts = np.zeros(len(composition.ALPHABET) + 1, dtype=np.int64) # folded, see composition.py
+    self.lengths = KLL(k)
+    self.gc = KLL(k)
+
+  # composition_matrix counts in bounded blocks, also for long sequences
+  def update(self, sequences):
+    counts = composition.composition_matrix(sequences)
+    self.count += len(counts)
+    self.total += int(counts.sum())
+    self.counts += counts.sum(axis=0)
+    self.lengths.update(counts.sum(axis=1))
+    self.gc.update(composition.gc_fraction(counts) * 100)
+
+  def merge(self, other):
+    self.count += other.count
+    self.total += other.total
+    self.counts += other.counts
+    self.lengths.merge(other.lengths)
+    self.gc.merge(other.gc)
+
+  def save(self, path):
+    np.savez(path, count=self.count, total=self.total, counts=self.counts,
+             **self.lengths.to_arrays("lengths_"), **self.gc.to_arrays("gc_"))
+
+  @classmethod
+  def load(cls, path):
+    stats = cls()
+    with np.load(path) as data:
+      stats.count = int(data["count"])
+      stats.total = int(data["total"])
+      stats.counts = data["counts"]
+      stats.lengths = KLL.from_arrays(data, "lengths_")
+      stats.gc = KLL.from_arrays(data, "gc_")
+    return stats
+
+  def print(self):
+    print(f"Number of sequences: {self.count}")
+    print(f"Total size of all sequences: {self.total} bases")
+    if not self.count:
+      return
+    print(f"Min sequence size: {int(self.lengths.min)}")
+    print(f"Quartiles of sequence size (approximate): {self.lengths.quantile([0.25, 0.5, 0.75])}")
+    print(f"Max sequence size: {int(self.lengths.max)}")
+    print(f"GC content of all sequences combined: {composition.gc_fraction(self.counts) * 100:.2f}%")
+    print(f"Min GC content: {self.gc.min:.2f}%")
+    print(f"Quartiles of GC content (approximate): {self.gc.quantile([0.25, 0.5, 0.75])}")
+    print(f"Max GC content: {self.gc.max:.2f}%")
+
+# stream the records of a fasta file in batches of about batch_size bases
+def stream_fasta_statistics(file_path, stats=None, batch_size=2**22):
+  stats = stats or StreamingStats()
+  batch = []
+  size = 0
+  for _, sequence in iter_fasta(file_path, binary=True):
+    batch.append(sequence)
+    size += len(sequence)
+    if size >= batch_size:
+      stats.update(batch)
+      batch = []
+      size = 0
+  if batch:
+    stats.update(batch)
+  return stats
+
 def plot_box_plots(sequence_lengths, gc_contents):
   fig, axs = plt.subplots(1, 2, figsize=(12, 6))
 
@@ -128,16 +190,19 @@ def calculate_codon_frequency(sequences):
                 codon_frequency[codon] = 1
     return codon_frequency
 
-def group_codon_frequency_by_amino_acid(sequences):
-    aa_codon_frequency = {}
+def group_codon_frequency_by_amino_acid(sequences, table=11):
+    # count codon indices of the first frame, then group the counts by the compiled code
+    code_table = get_code(table).table
+    counts = np.zeros(256, dtype=np.int64)
     for seq in sequences:
-        for i in range(0, len(seq) - 2, 3):
-            codon = seq[i:i+3]
-            aa = code.get(codon, None)  # Get the amino acid encoded by the codon
-            if aa:
-                if aa not in aa_codon_frequency:
-                    aa_codon_frequency[aa] = {}
-                aa_codon_frequency[aa][codon] = aa_codon_frequency[aa].get(codon, 0) + 1
+        counts += np.bincount(frames.frame_index(seq), minlength=256)
+    aa_codon_frequency = {}
+    for i, codon in enumerate(frames.CODONS):
+        if counts[i]:
+            aa = chr(code_table[i])
+            if aa not in aa_codon_frequency:
+                aa_codon_frequency[aa] = {}
+            aa_codon_frequency[aa][codon] = int(counts[i])
     return aa_codon_frequency
 
 
@@ -183,25 +248,60 @@ def main():
     description='print stats for a fasta file'
   )
   parser.add_argument('-i', '--input', default='/dev/fd/0', help="input file, default stdin")
+  parser.add_argument('-g', '--table', type=int, default=11, help="ncbi translation table, default 11")
+  parser.add_argument('-r', '--region', action='append', help="only use this region, name[:begin[-end]] 1-based inclusive, uses a .fai index, can be repeated")
+  parser.add_argument('-k', '--kmer', type=int, help="also count k-mers of this length, see kmers.py")
+  parser.add_argument('--canonical', action='store_true', help="count a k-mer and its reverse complement together")
+  parser.add_argument('--genes', help="compare the k-mers of the genes in this fasta file with the input")
+  parser.add_argument('-s', '--stream', action='store_true', help="only print the statistics, in one pass and constant memory")
+  parser.add_argument('--save', metavar='STATE', help="with --stream, save the statistics (.npz) to merge them with --merge later")
+  parser.add_argument('--merge', metavar='STATE', nargs='+', help="with --stream, print the statistics of saved states instead of reading the input")
   args = parser.parse_args()
+  if (args.save or args.merge) and not args.stream:
+    parser.error("--save and --merge need --stream")
+  if args.stream and (args.region or args.kmer):
+    parser.error("--stream only prints the statistics, without --region or --kmer")
+  if args.kmer is not None and not 0 < args.kmer <= kmers.MAX_K:
+    parser.error(f"k has to be between 1 and {kmers.MAX_K}")
+
+  if args.stream:
+    if args.merge:
+      stats = StreamingStats.load(args.merge[0])
+      for state in args.merge[1:]:
+        stats.merge(StreamingStats.load(state))
+    else:
+      stats = stream_fasta_statistics(args.input)
+    if args.save:
+      stats.save(args.save)
+    stats.print()
+    return
 
   print("reading sequences")
-  sequences = read_fasta(args.input)
+  if args.region:
+    with IndexedFasta(args.input) as fa:
+      sequences = {region: fa.fetch_region(region) for region in args.region}
+  else:
+    sequences = read_fasta(args.input)
   print("evaluating stats")
   sequence_lengths, gc_contents = print_fasta_statistics(sequences)
+  if args.kmer:
+    genome = kmers.count_sequences(sequences.values(), kmers.counter(args.kmer, args.canonical))
+    if args.genes:
+      kmers.print_comparison(args.genes, genome)
+    else:
+      kmers.print_counts(genome)
   #plot_box_plots_with_stats(sequence_lengths, gc_contents)
   plot_correlation(sequence_lengths, gc_contents)
   #codon_freq = calculate_codon_frequency(sequences.values())
   #print(codon_freq)
   #plot_codon_frequency(codon_freq)
-  groups = group_codon_frequency_by_amino_acid(sequences.values())
+  groups = group_codon_frequency_by_amino_acid(sequences.values(), args.table)
   print(groups)
   plot_codons_grouped(groups)
 
   # TODO compare genes to genome, code density, plot where the genes are?
   # gc content, codon_frequencies
-  # 
-  # k-mer analysis, also in comparision
+  #
   # put this into a notebook?
   #
   # compare between different organisms
@@ -1,58 +1,139 @@
-import os
-import os.path
+import argparse
+import functools
 import sys
 
-def codons(seq): # str -> [(int, str)]
-    for i in range(0, len(seq), 3):
-        if i+3 <= len(seq):
-            yield i, seq[i:i+3]
-
-# generate reading frames, return index of start codon and index of end codon
-def reading_frames(seq): # [(int, str)] -> iter (int, int)
-    for i in range(len(seq)):
-        if seq[i][1] == "ATG":
-            for j in range(i, len(seq)):
-                if seq[j][1] in ["TAG", "TGA", "TAA"]:
-                    yield i, j
-                    break
-
-def print_frames(sequences):
-    for c, seq in enumerate(sequences):
-        for i,j in reading_frames(seq):
-            if abs(i - j) < 30:
-                continue
-            print(f"seq {c}: {seq[i][0]: >5} {seq[j][0]}: ", end="")
-            for k in range(i,j+1):
-                print(f"{seq[k][1]} ", end="")
-            print()
-
-
-translation_table = str.maketrans('ATGC', 'TACG')
-def complement_dna(seq): # str -> str
-    return seq.translate(translation_table)
-
-def complementary_sequence(seq): # [(int, str)] -> [(int, str)]
-    return [ (i + 2, complement_dna(c[::-1])) for i,c in seq[::-1] ]
+import numpy as np
 
-def main():
-    # declare vars to be available interactively
-    global sequence
-    global sequences
+import code
+import fasta
+import frames
+import packed
+
+# call as $ python find_frames.py file.fna -o file.gff
+# or $ python find_frames.py file.fna -f getorf -o file.getorf for getorf -find 3 style output
+# both can be compared to prodigal with diff.py
+
+complement_table = bytes.maketrans(b'ACGTRYSWKMBDHVNacgtryswkmbdhvn', b'TGCAYRSWMKVHDBNtgcayrswmkvhdbn')
+def reverse_complement(seq): # bytes | PackedSequence -> the same type
+    if isinstance(seq, packed.PackedSequence):
+        return seq.reverse_complement()
+    return seq.translate(complement_table)[::-1]
+
+# codon indices (frames.CODONS) of codons given as strings, codons with other letters never match
+def codon_indices(codons):
+    return [frames.CODONS.index(c) for c in codons if c in frames.CODONS]
+
+# open reading frames of a single frame, in codon indices
+# every start codon is paired with the next stop codon, this is the same as
+# scanning the frame once and remembering the last stop: all starts between two stops share the second one
+# nested: report every start, longest: only the first start after each stop
+def reading_frames(codons, start_ids, stop_ids, longest=False): # -> (np.array, np.array)
+    stops = np.flatnonzero(np.isin(codons, stop_ids))
+    starts = np.flatnonzero(np.isin(codons, start_ids))
+    following = np.searchsorted(stops, starts)
+    # starts after the last stop are not terminated
+    starts, following = starts[following < len(stops)], following[following < len(stops)]
+    if longest and len(starts):
+        first = np.ones(len(starts), dtype=bool)
+        first[1:] = following[1:] != following[:-1]
+        starts, following = starts[first], following[first]
+    return starts, stops[following]
 
-    with open("Xanthomonas.fna") as f:
-        lines = f.readlines()
-        lines = lines[1:] # cut out header
+# orfs of both strands in 1-based forward coordinates
+# yields (strand, start, stop), start is the first base of the start codon, stop the last base of the stop codon
+# forward orfs come first, each strand is ordered by position
+# the stop codons are those of the ncbi translation table
+# the sequence is only looked at as base codes (frames.encode), so a PackedSequence is never unpacked to text
+def find_orfs(seq, start_codons=("ATG",), min_length=90, longest=False, table=11):
+    encoded = frames.encode(seq)
+    start_ids = codon_indices(start_codons)
+    stop_ids = codon_indices(code.get_code(table).stop_codons)
+    length = len(encoded)
+    # complement in TCAG order is xor 2, ambiguous codes stay above 3
+    for strand, strand_codes in ((1, encoded), (-1, (encoded ^ 2)[::-1])):
+        orfs = []
+        for offset in range(3):
+            starts, stops = reading_frames(frames.encoded_frame_index(strand_codes, offset), start_ids, stop_ids, longest)
+            # min_length counts the bases of the orf without the stop codon
+            keep = (stops - starts) * 3 >= min_length
+            orfs.append(np.stack([starts[keep] * 3 + offset, stops[keep] * 3 + offset + 3], axis=1))
+        orfs = np.concatenate(orfs)
+        # order by position on the forward strand
+        orfs = orfs[np.argsort(orfs[:, 0] if strand == 1 else -orfs[:, 0], kind='stable')]
+        for begin, end in orfs.tolist():
+            if strand == 1:
+                yield strand, begin + 1, end
+            else:
+                yield strand, length - begin, length - end + 1
+
+def write_gff(output_file, seqid, orfs, seq):
+    for i, (strand, start, stop) in enumerate(orfs, 1):
+        begin, end = (start, stop) if strand == 1 else (stop, start)
+        start_codon = seq[begin-1:begin+2] if strand == 1 else reverse_complement(seq[end-3:end])
+        attributes = f"ID={seqid}_{i};start_type={bytes(start_codon).decode().upper()}"
+        print(seqid, "find_frames", "CDS", begin, end, ".", "+-"[strand == -1], 0, attributes, sep="\t", file=output_file)
+
+# getorf -find 3 writes the orf without the stop codon as [start - end],
+# start > end on the reverse strand
+def write_getorf(output_file, seqid, orfs, seq, width=60):
+    for i, (strand, start, stop) in enumerate(orfs, 1):
+        if strand == 1:
+            end = stop - 3
+            orf = bytes(seq[start-1:end])
+            print(f">{seqid}_{i} [{start} - {end}]", file=output_file)
+        else:
+            end = stop + 3
+            orf = bytes(reverse_complement(seq[end-1:start]))
+            print(f">{seqid}_{i} [{start} - {end}] (REVERSE SENSE)", file=output_file)
+        for j in range(0, len(orf), width):
+            print(orf[j:j+width].decode(), file=output_file)
+
+# protein fasta of the orfs, ambiguous codons are translated like code.translate does (GCN is A)
+def write_protein(output_file, seqid, orfs, seq, width=60, table=11):
+    for i, (strand, start, stop) in enumerate(orfs, 1):
+        # without the stop codon, like getorf
+        if strand == 1:
+            end = stop - 3
+            orf = seq[start-1:end]
+        else:
+            end = stop + 3
+            orf = reverse_complement(seq[end-1:start])
+        sense = "" if strand == 1 else " (REVERSE SENSE)"
+        print(f">{seqid}_{i} [{start} - {end}]{sense}", file=output_file)
+        protein = code.translate(orf, table=table)
+        for j in range(0, len(protein), width):
+            print(protein[j:j+width], file=output_file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='find_frames.py',
+        description='find open reading frames in all six frames'
+    )
+    parser.add_argument('input', nargs='?', default='Xanthomonas.fna', help="fasta file with the genome")
+    parser.add_argument('-o', '--output', default='/dev/fd/1', help="output file, default stdout")
+    parser.add_argument('-f', '--format', choices=['gff', 'getorf', 'protein'], default='gff', help="gff, getorf -find 3 compatible fasta or translated orfs")
+    parser.add_argument('-s', '--starts', default='ATG', help="comma separated start codons, e.g. ATG,GTG,TTG, or 'table' for all starts of the translation table")
+    parser.add_argument('-g', '--table', type=int, default=11, help="ncbi translation table for stop codons and translation, default 11")
+    parser.add_argument('-m', '--min-length', type=int, default=90, help="minimum orf length in bases, without the stop codon")
+    parser.add_argument('--longest', action='store_true', help="only report the longest orf for each stop instead of every nested start")
+    parser.add_argument('--packed', action='store_true', help="hold each sequence 2-bit packed (4 bases per byte) instead of as text, orfs are written uppercase")
+    args = parser.parse_args()
 
-        sequence = "".join(line[:-1] for line in lines) # remove newlines
-        sequences = [
-            sequence, 
-            sequence[1:], 
-            sequence[2:]
-        ]
-        sequences = [ list(codons(s)) for s in sequences ]
-        sequences = sequences + [ complementary_sequence(s) for s in sequences ]
+    genetic_code = code.get_code(args.table)
+    if args.starts == 'table':
+        start_codons = sorted(genetic_code.start_codons)
+    else:
+        start_codons = [c.strip().upper() for c in args.starts.split(",")]
+    write = {'gff': write_gff, 'getorf': write_getorf, 'protein': functools.partial(write_protein, table=genetic_code)}[args.format]
 
-        print_frames(sequences)
+    with open(args.output, "w") as output_file:
+        if args.format == 'gff':
+            print("##gff-version 3", file=output_file)
+        for seqid, seq in fasta.iter_fasta(args.input, binary=True):
+            print(f"scanning {seqid}", file=sys.stderr)
+            seq = packed.PackedSequence(seq) if args.packed else bytes(seq)
+            orfs = find_orfs(seq, start_codons, args.min_length, args.longest, genetic_code)
+            write(output_file, seqid, orfs, seq)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,3 +1,5 @@
+import numpy as np
+
 def codons(seq): # str -> [(int, str)]
     for i in range(0, len(seq), 3):
         if i+3 <= len(seq):
@@ -19,4 +21,95 @@ def frames(sequence):
     ]
     sequences = [ list(codons(s)) for s in sequences ]
     sequences = sequences + [ complementary_sequence(s) for s in sequences ]
-    return sequences
\ No newline at end of file
+    return sequences
+
+# compact frames: every codon is an index 0-63, 255 marks codons with ambiguous bases
+# bases are numbered in TCAG order, so index = 16*first + 4*second + third,
+# the same order the ncbi genetic code tables use
+
+BASES = "TCAG"
+CODONS = [a + b + c for a in BASES for b in BASES for c in BASES]
+AMBIGUOUS = 255
+
+base_table = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(BASES):
+    base_table[ord(base)] = i
+    base_table[ord(base.lower())] = i
+base_table[ord("U")] = base_table[ord("u")] = 0
+
+def encode(sequence): # str | bytes-like | PackedSequence -> np.array(uint8), bases 0-3, 4 for anything else
+    if hasattr(sequence, 'encoded'): # packed.PackedSequence is already encoded
+        return sequence.encoded()
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii')
+    return base_table[np.frombuffer(sequence, dtype=np.uint8)]
+
+def _pack(a, b, c):
+    index = (a << 4) | (b << 2) | c
+    index[(a | b | c) > 3] = AMBIGUOUS
+    return index
+
+# index of the codon starting at every position, shape (len - 2,)
+def codon_index(encoded):
+    return _pack(encoded[:-2], encoded[1:-1], encoded[2:])
+
+# index of the reverse complement of the codon starting at every position
+# complement in TCAG order is xor 2 (T <-> A, C <-> G)
+def reverse_codon_index(encoded):
+    complement = encoded ^ 2
+    return _pack(complement[2:], complement[1:-1], complement[:-2])
+
+# codon indices of the forward frame starting at offset
+def frame_index(sequence, offset=0):
+    return encoded_frame_index(encode(sequence), offset)
+
+# the same for already encoded bases, e.g. a reverse complement (encoded ^ 2)[::-1]
+def encoded_frame_index(encoded, offset=0):
+    encoded = encoded[offset:]
+    end = len(encoded) // 3 * 3
+    return _pack(encoded[0:end:3], encoded[1:end:3], encoded[2:end:3])
+
+# same frames as frames(), as uint8 arrays of codon indices
+def index_frames(sequence): # -> [np.array(uint8)] * 6
+    encoded = encode(sequence)
+    forward = codon_index(encoded)
+    reverse = reverse_codon_index(encoded)
+    result = []
+    for offset in range(3):
+        count = max(len(encoded) - offset, 0) // 3
+        result.append(forward[offset:offset + 3*count:3])
+    for offset in range(3):
+        count = max(len(encoded) - offset, 0) // 3
+        result.append(reverse[offset:offset + 3*count:3][::-1])
+    return result
+
+# codon counts of all six frames, shape (64,)
+def codon_usage(sequence):
+    return sum(np.bincount(f, minlength=256)[:64] for f in index_frames(sequence))
+
+# positions of the codons of each gene, genes are (begin, end, strand) in 1-based inclusive coordinates
+# reverse genes are read from their end, like their reverse complement sequence
+# returns (gene number, codon start position, strand) for every codon
+def gene_codon_positions(begins, ends, strands):
+    begins = np.asarray(begins, dtype=np.int64) - 1
+    ends = np.asarray(ends, dtype=np.int64)
+    strands = np.asarray(strands, dtype=np.int64)
+    counts = (ends - begins) // 3
+    gene = np.repeat(np.arange(len(counts)), counts)
+    # k-th codon within its gene
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    first = np.where(strands == 1, begins, ends - 3)
+    position = first[gene] + 3 * k * strands[gene]
+    return gene, position, strands[gene]
+
+# codon indices of every codon of the genes, in gene order
+def gene_codons(sequence, begins, ends, strands):
+    encoded = encode(sequence)
+    gene, position, strand = gene_codon_positions(begins, ends, strands)
+    codons = np.where(strand == 1, codon_index(encoded)[position], reverse_codon_index(encoded)[position])
+    return gene, codons
+
+# pooled codon counts of the genes, shape (64,)
+def gene_codon_usage(sequence, begins, ends, strands):
+    _, codons = gene_codons(sequence, begins, ends, strands)
+    return np.bincount(codons, minlength=256)[:64]
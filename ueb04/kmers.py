@@ -0,0 +1,252 @@
+# k-mer counting for nucleotide sequences
+# bases are 2-bit codes in TCAG order (frames.encode), a k-mer is the number formed by its k codes,
+# so up to k = 31 fits into an uint64. canonical k-mers are the smaller of a k-mer and its
+# reverse complement. k <= 12 is counted exactly in an array of 4^k counts, larger k in a
+# count-min sketch of fixed size (uint32 counters): estimates are never too small, too large only by collisions.
+# sequences are streamed record by record and long records in overlapping chunks,
+# so the memory only depends on the counter and the chunk size
+import argparse
+import sys
+
+import numpy as np
+
+import fasta
+import frames
+
+MAX_DENSE_K = 12
+MAX_K = 31
+
+# codes of all k-mers of a sequence without ambiguous bases, in order
+def kmer_codes(sequence, k, canonical=False): # -> np.array(uint64)
+    encoded = frames.encode(sequence)
+    n = len(encoded) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    # rolling 2-bit encoding: shift in one base of every window at a time
+    codes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        codes = (codes << np.uint64(2)) | encoded[j:j+n]
+    if canonical:
+        # the complement in TCAG order is xor 2, the last base becomes the first
+        complement = encoded ^ 2
+        reverse = np.zeros(n, dtype=np.uint64)
+        for j in range(k):
+            reverse |= complement[j:j+n].astype(np.uint64) << np.uint64(2 * j)
+        codes = np.minimum(codes, reverse)
+    # windows without an ambiguous base
+    ambiguous = np.concatenate([[0], np.cumsum(encoded > 3)])
+    return codes[ambiguous[k:] == ambiguous[:n]]
+
+def decode(code, k): # int -> str
+    return "".join(frames.BASES[(int(code) >> (2 * (k - 1 - j))) & 3] for j in range(k))
+
+def encode_kmer(kmer): # str -> int
+    code = 0
+    for base in frames.encode(kmer).tolist():
+        if base > 3:
+            raise ValueError(f"ambiguous base in {kmer}")
+        code = code << 2 | base
+    return code
+
+# exact counts of all 4^k k-mers
+class DenseCounter:
+    def __init__(self, k, canonical=False):
+        if k > MAX_DENSE_K:
+            raise ValueError(f"dense counting only up to k = {MAX_DENSE_K}")
+        self.k = k
+        self.canonical = canonical
+        self.counts = np.zeros(4 ** k, dtype=np.int64)
+        self.total = 0
+
+    def add(self, sequence):
+        codes = kmer_codes(sequence, self.k, self.canonical)
+        if len(codes) > len(self.counts) // 8:
+            self.counts += np.bincount(codes.astype(np.int64), minlength=len(self.counts))
+        else:
+            # a short chunk, don't allocate all 4^k counts for it
+            kmers, counts = np.unique(codes, return_counts=True)
+            self.counts[kmers.astype(np.int64)] += counts
+        self.total += len(codes)
+
+    def estimate(self, codes): # -> np.array
+        return self.counts[np.asarray(codes, dtype=np.int64)]
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+
+    def distinct(self):
+        return int(np.count_nonzero(self.counts))
+
+    # how many k-mers occur once, twice, ...: spectrum[i] is the number of k-mers seen i times,
+    # spectrum[limit + 1] the number seen more often
+    def spectrum(self, limit=20):
+        return np.bincount(np.minimum(self.counts, limit + 1), minlength=limit + 2)
+
+    # the n most frequent k-mers as [(kmer, count)]
+    def most_common(self, n=10):
+        top = np.argsort(-self.counts, kind='stable')[:n]
+        return [(decode(code, self.k), int(self.counts[code])) for code in top if self.counts[code]]
+
+# count-min sketch: depth rows of width counters, every k-mer is counted once in each row
+# at a position given by a multiply-shift hash, its estimate is the smallest of these counters
+class CountMinSketch:
+    def __init__(self, k, canonical=False, width=2**22, depth=4, seed=0):
+        if k > MAX_K:
+            raise ValueError(f"k-mers only up to k = {MAX_K}")
+        self.k = k
+        self.canonical = canonical
+        self.bits = max(int(width - 1).bit_length(), 1)
+        self.width = 2 ** self.bits
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 2**63, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.table = np.zeros((depth, self.width), dtype=np.uint32)
+        self.total = 0
+
+    # the largest sketch that fits into memory bytes
+    @classmethod
+    def with_memory(cls, k, canonical=False, memory=2**30, depth=4, seed=0):
+        width = 2 ** ((memory // (depth * 4)).bit_length() - 1)
+        return cls(k, canonical, width, depth, seed)
+
+    def positions(self, codes): # -> (depth, len(codes))
+        # uint64 multiplication wraps around, the top bits are the hash
+        with np.errstate(over='ignore'):
+            return (codes[None, :] * self.multipliers[:, None]) >> np.uint64(64 - self.bits)
+
+    def add(self, sequence):
+        codes = kmer_codes(sequence, self.k, self.canonical)
+        for row, position in zip(self.table, self.positions(codes)):
+            # a bincount would allocate a whole row per chunk
+            position, counts = np.unique(position, return_counts=True)
+            row[position.astype(np.int64)] += counts.astype(np.uint32)
+        self.total += len(codes)
+
+    def estimate(self, codes): # -> np.array
+        codes = np.asarray(codes, dtype=np.uint64)
+        positions = self.positions(codes).astype(np.int64)
+        return np.min(np.take_along_axis(self.table, positions, axis=1), axis=0)
+
+    def merge(self, other):
+        if (self.table.shape != other.table.shape or self.k != other.k
+                or not np.array_equal(self.multipliers, other.multipliers)):
+            raise ValueError("only sketches with the same k, size and seed can be merged")
+        self.table += other.table
+        self.total += other.total
+
+# exact counter for small k, a sketch within memory bytes otherwise
+def counter(k, canonical=False, memory=2**30):
+    if k < 1:
+        raise ValueError("k has to be at least 1")
+    if k <= MAX_DENSE_K:
+        return DenseCounter(k, canonical)
+    return CountMinSketch.with_memory(k, canonical, memory)
+
+# pieces of sequence of about size bases that overlap by k - 1, so every k-mer is in exactly one
+def chunks(sequence, k, size=2**22):
+    for i in range(0, max(len(sequence) - k + 1, 1), size):
+        yield sequence[i:i+size+k-1]
+
+def count_sequences(sequences, counts):
+    for sequence in sequences:
+        for chunk in chunks(sequence, counts.k):
+            counts.add(chunk)
+    return counts
+
+# count the k-mers of all records of a fasta file, the file is mapped and read record by record
+def count_fasta(file_path, k, canonical=False, memory=2**30):
+    return count_sequences((sequence for _, sequence in fasta.iter_fasta(file_path, binary=True)), counter(k, canonical, memory))
+
+# compare the k-mer frequencies of two exact counters, e.g. genes and genome
+# returns statistics and the k-mers most over- and underrepresented in a
+def compare_dense(a, b, n=10): # -> (dict, [(kmer, log2 ratio)], [(kmer, log2 ratio)])
+    fa = a.counts / max(a.total, 1)
+    fb = b.counts / max(b.total, 1)
+    stats = {
+        "pearson": float(np.corrcoef(fa, fb)[0, 1]) if fa.std() and fb.std() else float('nan'),
+        "cosine": float(fa @ fb / (np.linalg.norm(fa) * np.linalg.norm(fb))) if fa.any() and fb.any() else float('nan'),
+        "l1": float(np.abs(fa - fb).sum()),
+        "shared": float(np.count_nonzero((a.counts > 0) & (b.counts > 0)) / max(np.count_nonzero(a.counts), 1)),
+    }
+    # pseudocount of one occurrence in each set
+    ratio = np.log2((a.counts + 1) / (a.total + len(a.counts))) - np.log2((b.counts + 1) / (b.total + len(b.counts)))
+    seen = np.flatnonzero((a.counts > 0) | (b.counts > 0))
+    order = seen[np.argsort(ratio[seen], kind='stable')]
+    over = [(decode(code, a.k), float(ratio[code])) for code in order[::-1][:n]]
+    under = [(decode(code, a.k), float(ratio[code])) for code in order[:n]]
+    return stats, over, under
+
+# compare a set of genes to a sketch of the genome, for large k
+# every gene k-mer is looked up in both sketches: the share of gene k-mers found in the genome
+# and the correlation of the log counts
+def compare_sketch(genes_file, genes, genome): # -> dict
+    found = 0
+    total = 0
+    sums = np.zeros(5)
+    for _, sequence in fasta.iter_fasta(genes_file, binary=True):
+        for chunk in chunks(sequence, genes.k):
+            codes = kmer_codes(chunk, genes.k, genes.canonical)
+            x = np.log2(genes.estimate(codes) / max(genes.total, 1) + 1e-12)
+            in_genome = genome.estimate(codes)
+            y = np.log2(in_genome / max(genome.total, 1) + 1e-12)
+            found += int(np.count_nonzero(in_genome))
+            total += len(codes)
+            sums += [x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()]
+    sx, sy, sxx, syy, sxy = sums
+    covariance = sxy - sx * sy / max(total, 1)
+    variance = (sxx - sx * sx / max(total, 1)) * (syy - sy * sy / max(total, 1))
+    return {
+        "found": found / max(total, 1),
+        "pearson_log": float(covariance / np.sqrt(variance)) if variance > 0 else float('nan'),
+    }
+
+def print_counts(counts, top=10, output_file=sys.stdout):
+    print(f"{counts.k}-mers: {counts.total}", file=output_file)
+    if isinstance(counts, DenseCounter):
+        print(f"distinct: {counts.distinct()}", file=output_file)
+        spectrum = counts.spectrum()
+        buckets = [f"{i}:{c}" for i, c in enumerate(spectrum[1:-1].tolist(), 1) if c] + [f">{len(spectrum) - 2}:{spectrum[-1]}"]
+        print("spectrum (occurrences:k-mers):", " ".join(buckets), file=output_file)
+        for kmer, count in counts.most_common(top):
+            print(kmer, count, sep="\t", file=output_file)
+
+# genome is a counter of the genome, the genes are counted with the same k
+def print_comparison(genes_file, genome, memory=2**30, output_file=sys.stdout):
+    genes = count_fasta(genes_file, genome.k, genome.canonical, memory)
+    print(f"{genome.k}-mers in genes: {genes.total}, in genome: {genome.total}", file=output_file)
+    if isinstance(genes, DenseCounter):
+        stats, over, under = compare_dense(genes, genome)
+        for name, value in stats.items():
+            print(f"{name}\t{value:.4f}", file=output_file)
+        print("overrepresented in genes:", " ".join(f"{kmer}({ratio:+.2f})" for kmer, ratio in over), file=output_file)
+        print("underrepresented in genes:", " ".join(f"{kmer}({ratio:+.2f})" for kmer, ratio in under), file=output_file)
+    else:
+        for name, value in compare_sketch(genes_file, genes, genome).items():
+            print(f"{name}\t{value:.4f}", file=output_file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='kmers.py',
+        description='count k-mers and compare k-mer spectra'
+    )
+    parser.add_argument('input', help="fasta file, the genes with --compare")
+    parser.add_argument('-k', type=int, default=8, help=f"k-mer length, exact up to {MAX_DENSE_K}, sketched up to {MAX_K}, default 8")
+    parser.add_argument('-c', '--canonical', action='store_true', help="count a k-mer and its reverse complement together")
+    parser.add_argument('-m', '--memory', type=int, default=1024, help="memory for sketches in MiB, default 1024")
+    parser.add_argument('--compare', metavar='GENOME', help="compare the k-mers of input (e.g. genes) with this fasta file")
+    parser.add_argument('-n', '--top', type=int, default=10, help="number of frequent k-mers to print, default 10")
+    args = parser.parse_args()
+
+    if not 0 < args.k <= MAX_K:
+        parser.error(f"k has to be between 1 and {MAX_K}")
+    if args.memory < 1:
+        parser.error("the memory for sketches has to be at least 1 MiB")
+    memory = args.memory * 2**20
+    if args.compare:
+        genome = count_fasta(args.compare, args.k, args.canonical, memory // 2)
+        print_comparison(args.input, genome, memory // 2)
+    else:
+        print_counts(count_fasta(args.input, args.k, args.canonical, memory), args.top)
+
+if __name__ == "__main__":
+    main()
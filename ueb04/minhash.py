@@ -0,0 +1,226 @@
+# MinHash sketches of genomes or proteomes and Mash distances between them (Ondov et al. 2016)
+# a sketch is the set of the size smallest hashes of all (canonical) k-mers of a sequence set.
+# the smallest hashes of the union of two sketches are a random sample of the union of their
+# k-mers, the share of them in both sketches estimates the Jaccard index j, and
+# the Mash distance -1/k * ln(2j / (1 + j)) approximates the mutation rate.
+# sketches are built in one pass over the mapped fasta file, several sketch files
+# (e.g. of different machines) can be given to dist, which writes a PHYLIP matrix for fneighbour
+import argparse
+import os.path
+import sys
+
+import numpy as np
+
+import fasta
+import kmers
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+INVALID = 255
+amino_acid_table = np.full(256, INVALID, dtype=np.uint8)
+for i, aa in enumerate(AMINO_ACIDS):
+    amino_acid_table[ord(aa)] = i
+    amino_acid_table[ord(aa.lower())] = i
+MAX_PROTEIN_K = 12 # 5 bits per amino acid
+
+# codes of all protein k-mers without unknown amino acids, 5 bits per amino acid
+def protein_codes(sequence, k): # -> np.array(uint64)
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', 'replace')
+    encoded = amino_acid_table[np.frombuffer(sequence, dtype=np.uint8)]
+    n = len(encoded) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    codes = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        codes = (codes << np.uint64(5)) | encoded[j:j+n]
+    invalid = np.concatenate([[0], np.cumsum(encoded == INVALID)])
+    return codes[invalid[k:] == invalid[:n]]
+
+# splitmix64 finalizer, a k-mer code -> a well mixed 64 bit hash
+def hash_codes(codes, seed=42): # -> np.array(uint64)
+    with np.errstate(over='ignore'):
+        x = codes + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+class Sketch:
+    def __init__(self, k=21, size=1000, protein=False, seed=42):
+        if size < 1:
+            raise ValueError("the sketch size has to be at least 1")
+        self.k = k
+        self.size = size
+        self.protein = protein
+        self.seed = seed
+        self.hashes = np.zeros(0, dtype=np.uint64) # sorted, distinct
+        self.total = 0 # k-mers seen
+
+    def add(self, sequence):
+        if self.protein:
+            codes = protein_codes(sequence, self.k)
+        else:
+            codes = kmers.kmer_codes(sequence, self.k, canonical=True)
+        self.total += len(codes)
+        h = hash_codes(codes, self.seed)
+        if len(self.hashes) == self.size:
+            # most hashes of a long sequence are larger than the whole sketch
+            h = h[h < self.hashes[-1]]
+        if len(h):
+            self.hashes = np.union1d(self.hashes, h)[:self.size]
+
+    def add_sequences(self, sequences):
+        for sequence in sequences:
+            for chunk in kmers.chunks(sequence, self.k):
+                self.add(chunk)
+        return self
+
+# {name: Sketch} of every fasta file, or of every record with records set
+def sketch_files(paths, k=21, size=1000, protein=False, records=False, seed=42):
+    sketches = dict()
+    for path in paths:
+        if records:
+            for id, sequence in fasta.iter_fasta(path, binary=True):
+                if id in sketches:
+                    raise ValueError(f"{path}: record {id} occurs twice")
+                sketches[id] = Sketch(k, size, protein, seed).add_sequences([sequence])
+        else:
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name in sketches:
+                raise ValueError(f"{path}: another file is also named {name}")
+            sequences = (sequence for _, sequence in fasta.iter_fasta(path, binary=True))
+            sketches[name] = Sketch(k, size, protein, seed).add_sequences(sequences)
+    return sketches
+
+# all sketches in one .npz: the hashes one after another and where each sketch starts
+def save_sketches(path, sketches):
+    first = next(iter(sketches.values()), Sketch())
+    hashes = [sketch.hashes for sketch in sketches.values()]
+    np.savez_compressed(
+        path,
+        names=np.array(list(sketches), dtype=bytes),
+        offsets=np.cumsum([0] + [len(h) for h in hashes]),
+        hashes=np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64),
+        totals=np.array([sketch.total for sketch in sketches.values()], dtype=np.int64),
+        parameters=np.array([first.k, first.size, first.protein, first.seed], dtype=np.int64),
+    )
+
+def load_sketches(path): # -> {name: Sketch}
+    with np.load(path) as data:
+        k, size, protein, seed = data["parameters"].tolist()
+        sketches = dict()
+        for i, name in enumerate(data["names"].astype(str).tolist()):
+            sketch = Sketch(k, size, bool(protein), seed)
+            sketch.hashes = data["hashes"][data["offsets"][i]:data["offsets"][i+1]]
+            sketch.total = int(data["totals"][i])
+            sketches[name] = sketch
+        return sketches
+
+# sketches of several files, they have to be built with the same k, alphabet and seed
+def merge_sketches(paths): # -> {name: Sketch}
+    sketches = dict()
+    for path in paths:
+        for name, sketch in load_sketches(path).items():
+            if name in sketches:
+                raise ValueError(f"{path}: {name} is already in another sketch file")
+            sketches[name] = sketch
+    parameters = {(sketch.k, sketch.protein, sketch.seed) for sketch in sketches.values()}
+    if len(parameters) > 1:
+        raise ValueError("sketches were built with different k, alphabet or seed")
+    return sketches
+
+def jaccard(a, b, size): # -> float
+    union = np.union1d(a, b)[:size]
+    if not len(union):
+        return 0.0
+    shared = np.count_nonzero(np.isin(union, a, assume_unique=True) & np.isin(union, b, assume_unique=True))
+    return shared / len(union)
+
+def mash_distance(j, k): # -> float
+    if j <= 0:
+        return 1.0
+    return min(-np.log(2 * j / (1 + j)) / k, 1.0)
+
+# all-vs-all Mash distances, sketches of different sizes are compared with the smaller size
+# one sketch at a time against all others: the hashes of all sketches are looked up in it, the rank of a
+# shared hash in the union of both sketches is the number of smaller hashes in either minus the shared ones
+def distance_matrix(sketches): # -> ([name], np.array)
+    names = list(sketches)
+    values = list(sketches.values())
+    n = len(values)
+    lengths = np.array([len(sketch.hashes) for sketch in values], dtype=np.int64)
+    sizes = np.array([sketch.size for sketch in values], dtype=np.int64)
+    width = max(lengths.max(initial=0), 1)
+    hashes = np.zeros((n, width), dtype=np.uint64)
+    valid = np.arange(width) < lengths[:, None]
+    hashes[valid] = np.concatenate([sketch.hashes for sketch in values]) if n else []
+    matrix = np.zeros((n, n))
+    for i, sketch in enumerate(values):
+        a = sketch.hashes
+        # only the sketches after i, the matrix is symmetric
+        other, other_valid = hashes[i+1:], valid[i+1:]
+        if not len(a):
+            matrix[i, i+1:] = matrix[i+1:, i] = 1.0
+            continue
+        position = np.searchsorted(a, other)
+        shared = other_valid & (a[np.minimum(position, len(a) - 1)] == other)
+        rank = np.arange(width) + position - (np.cumsum(shared, axis=1) - shared)
+        size = np.minimum(sizes[i+1:], sketch.size)
+        union = np.minimum(lengths[i+1:] + len(a) - shared.sum(axis=1), size)
+        j = np.count_nonzero(shared & (rank < size[:, None]), axis=1) / np.maximum(union, 1)
+        with np.errstate(divide='ignore'):
+            matrix[i, i+1:] = matrix[i+1:, i] = np.minimum(-np.log(2 * j / (1 + j)) / sketch.k, 1.0)
+    return names, matrix
+
+# square PHYLIP distance matrix, names are padded or cut to 10 characters
+def write_phylip(output_file, names, matrix):
+    short = [name[:10] for name in names]
+    if len(set(short)) != len(short):
+        raise ValueError("names are not unique in their first 10 characters")
+    print(f"{len(names):5d}", file=output_file)
+    for name, row in zip(short, matrix):
+        print(f"{name:<10}", " ".join(f"{d:.6f}" for d in row), file=output_file)
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='minhash.py',
+        description='MinHash sketches and Mash distances of genomes or proteomes'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sketch = subparsers.add_parser('sketch', help="sketch fasta files")
+    sketch.add_argument('fasta_files', nargs='+')
+    sketch.add_argument('-o', '--output', required=True, help="sketch file (.npz)")
+    sketch.add_argument('-k', type=int, help="k-mer length, default 21, 9 with --protein")
+    sketch.add_argument('-s', '--size', type=int, default=1000, help="hashes per sketch, default 1000")
+    sketch.add_argument('-p', '--protein', action='store_true', help="amino acid sequences")
+    sketch.add_argument('-r', '--records', action='store_true', help="sketch every record instead of every file")
+    sketch.add_argument('--seed', type=int, default=42, help="hash seed, default 42")
+    dist = subparsers.add_parser('dist', help="distance matrix of sketches in PHYLIP format, e.g. for fneighbour")
+    dist.add_argument('sketch_files', nargs='+', help="sketch files of minhash.py sketch")
+    dist.add_argument('-o', '--output', default='/dev/fd/1', help="output file, default stdout")
+    args = parser.parse_args()
+
+    if args.command == 'sketch':
+        k = args.k or (9 if args.protein else 21)
+        max_k = MAX_PROTEIN_K if args.protein else kmers.MAX_K
+        if not 0 < k <= max_k:
+            parser.error(f"k has to be between 1 and {max_k}")
+        if args.size < 1:
+            parser.error("the sketch size has to be at least 1")
+        try:
+            sketches = sketch_files(args.fasta_files, k, args.size, args.protein, args.records, args.seed)
+        except ValueError as e:
+            parser.error(str(e))
+        with open(args.output, 'wb') as f:
+            save_sketches(f, sketches)
+        print(f"{len(sketches)} sketches", file=sys.stderr)
+        return
+
+    try:
+        names, matrix = distance_matrix(merge_sketches(args.sketch_files))
+        with open(args.output, "w") as output_file:
+            write_phylip(output_file, names, matrix)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
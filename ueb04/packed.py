@@ -0,0 +1,170 @@
+# 2-bit packed nucleotide sequences
+# four bases per byte in TCAG order (the same codes frames.encode uses),
+# everything that is not A, C, G or T (N and the other IUPAC codes) is kept
+# in a sparse list of exceptions. bases are stored uppercase.
+# slices and reverse complements are views on the same packed data
+import numpy as np
+
+import frames
+
+letters = np.frombuffer(frames.BASES.encode('ascii'), dtype=np.uint8)
+iupac_complement = bytes.maketrans(b'ACGTRYSWKMBDHVN', b'TGCAYRSWMKVHDBN')
+
+code_table = np.full(256, 4, dtype=np.uint8)
+for i, base in enumerate(frames.BASES):
+    code_table[ord(base)] = i
+    code_table[ord(base.lower())] = i
+upper_table = np.frombuffer(bytes(range(256)).upper(), dtype=np.uint8)
+
+shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+def pack(codes): # np.array(uint8) of codes 0-3 -> np.array(uint8), 4 codes per byte
+    padded = np.zeros((len(codes) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    return np.bitwise_or.reduce(padded.reshape(-1, 4) << shifts, axis=1).astype(np.uint8)
+
+def unpack(packed): # np.array(uint8) -> np.array(uint8) of codes, 4 per byte
+    return ((packed[:, None] >> shifts) & 3).reshape(-1)
+
+class PackedSequence:
+    # sequence is packed in blocks of block bases, so there is never a full size unpacked copy
+    def __init__(self, sequence=b"", block=2**22):
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii')
+        elif isinstance(sequence, PackedSequence):
+            sequence = bytes(sequence)
+        view = memoryview(sequence).cast('B')
+        block = max(block // 4 * 4, 4)
+        packed, positions, values = [], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.uint8)]
+        for i in range(0, len(view), block):
+            raw = np.frombuffer(view[i:i+block], dtype=np.uint8)
+            codes = code_table[raw]
+            exceptions = np.flatnonzero(codes == 4)
+            positions.append(exceptions + i)
+            values.append(upper_table[raw[exceptions]])
+            codes[exceptions] = 0
+            packed.append(pack(codes))
+        self._packed = np.concatenate(packed) if packed else np.zeros(0, dtype=np.uint8)
+        self._positions = np.concatenate(positions)
+        self._values = np.concatenate(values)
+        self._start = 0
+        self._stop = len(view)
+        self._reverse = False
+
+    @classmethod
+    def _view(cls, packed, positions, values, start, stop, reverse):
+        view = cls.__new__(cls)
+        view._packed = packed
+        view._positions = positions
+        view._values = values
+        view._start = start
+        view._stop = stop
+        view._reverse = reverse
+        return view
+
+    def __len__(self):
+        return self._stop - self._start
+
+    # memory used by this view's packed data and exceptions, shared with other views
+    @property
+    def nbytes(self):
+        return self._packed.nbytes + self._positions.nbytes + self._values.nbytes
+
+    def reverse_complement(self):
+        return self._view(self._packed, self._positions, self._values, self._start, self._stop, not self._reverse)
+
+    # exceptions in the forward range of this view: (positions relative to start, values)
+    def _exceptions(self):
+        lo, hi = np.searchsorted(self._positions, [self._start, self._stop])
+        return self._positions[lo:hi] - self._start, self._values[lo:hi]
+
+    def _forward_codes(self):
+        first = self._start // 4
+        last = (self._stop + 3) // 4
+        codes = unpack(self._packed[first:last])
+        return codes[self._start - 4*first : self._stop - 4*first]
+
+    # base codes 0-3 in TCAG order, 4 for everything else, like frames.encode
+    def encoded(self):
+        codes = self._forward_codes()
+        positions, _ = self._exceptions()
+        if self._reverse:
+            codes = (codes ^ 2)[::-1] # complement in TCAG order is xor 2
+            positions = len(self) - 1 - positions
+        codes[positions] = 4
+        return codes
+
+    def __bytes__(self):
+        raw = letters[self._forward_codes()]
+        positions, values = self._exceptions()
+        raw[positions] = values
+        raw = raw.tobytes()
+        if self._reverse:
+            raw = raw.translate(iupac_complement)[::-1]
+        return raw
+
+    def __str__(self):
+        return bytes(self).decode('ascii')
+
+    def __repr__(self):
+        if len(self) > 40:
+            return f"PackedSequence('{self[:20]}...{self[-20:]}', length={len(self)})"
+        return f"PackedSequence('{self}')"
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return str(self) == other
+        if isinstance(other, (bytes, PackedSequence)):
+            return bytes(self) == bytes(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            begin, end, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("PackedSequence only supports contiguous slices")
+            end = max(begin, end)
+            if self._reverse:
+                begin, end = self._stop - end, self._stop - begin
+            else:
+                begin, end = self._start + begin, self._start + end
+            return self._view(self._packed, self._positions, self._values, begin, end, self._reverse)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("PackedSequence index out of range")
+        position = self._stop - 1 - key if self._reverse else self._start + key
+        i = np.searchsorted(self._positions, position)
+        if i < len(self._positions) and self._positions[i] == position:
+            base = bytes([self._values[i]])
+        else:
+            base = frames.BASES[(self._packed[position >> 2] >> (6 - 2*(position & 3))) & 3].encode('ascii')
+        if self._reverse:
+            base = base.translate(iupac_complement)
+        return base.decode('ascii')
+
+    # pickles only the packed bytes covered by this view
+    def __reduce__(self):
+        first = self._start // 4
+        last = (self._stop + 3) // 4
+        lo, hi = np.searchsorted(self._positions, [self._start, self._stop])
+        offset = 4 * first
+        state = (
+            self._packed[first:last].tobytes(),
+            (self._positions[lo:hi] - offset).astype(np.int64).tobytes(),
+            self._values[lo:hi].tobytes(),
+            self._start - offset,
+            self._stop - offset,
+            self._reverse,
+        )
+        return _unpickle, state
+
+def _unpickle(packed, positions, values, start, stop, reverse):
+    return PackedSequence._view(
+        np.frombuffer(packed, dtype=np.uint8),
+        np.frombuffer(positions, dtype=np.int64),
+        np.frombuffer(values, dtype=np.uint8),
+        start, stop, reverse
+    )
@@ -1,5 +1,14 @@
 import argparse
-from code import code
+import concurrent.futures
+import io
+import os
+
+import numpy as np
+
+import fasta
+import faidx
+from code import code, get_code
+from faidx import IndexedFasta, parse_region
 
 # generator that consumes input lines of nucleotides
 # and prints them to a file in a table. with indices and amino acids
@@ -105,6 +114,203 @@ def stoptabulator(gen):
     except StopIteration:
         pass
 
+# formats the same table as tabulator, but a block of whole rows at a time:
+# bases are collected until there are enough for many rows, the rows are laid out
+# with numpy and written with a single write. input has to be latin-1 (ascii)
+class BlockFormatter:
+    # start is the number of bases already formatted, it has to be a multiple of n
+    def __init__(self, output_file, begin=None, dir=None, n=30, table=11, block_rows=4096, start=0):
+        self.output_file = output_file
+        self.begin = 0 if begin is None else begin
+        self.dir = 1 if dir is None else dir
+        self.n = n
+        self.genetic_code = get_code(table)
+        self.block = block_rows * n
+        self.pending = [] # lines not yet formatted
+        self.pending_length = 0
+        self.i = start # number of bases formatted
+
+        # columns of the bases in a row, a space after every triplett
+        self.columns = np.arange(n) + np.arange(n) // 3
+        self.width = n + 2 * (n // 3) + 2
+
+    def send(self, line):
+        self.pending.append(line)
+        self.pending_length += len(line)
+        if self.pending_length >= self.block:
+            self.flush()
+
+    # format all complete rows in pending
+    def flush(self):
+        seq = "".join(self.pending)
+        rows = len(seq) // self.n
+        if rows:
+            self.output_file.write(self.format_rows(seq[:rows * self.n]))
+        rest = seq[rows * self.n:]
+        self.pending = [rest]
+        self.pending_length = len(rest)
+
+    def format_rows(self, seq): # len(seq) is a multiple of n
+        n = self.n
+        rows = len(seq) // n
+        bases = np.frombuffer(seq.encode('latin-1'), dtype=np.uint8).reshape(rows, n)
+        body = np.full((rows, self.width), ord(" "), dtype=np.uint8)
+        body[:, self.columns] = bases
+        # amino acids, only exact uppercase codons are translated like code.get(codon, 'X')
+        codes = strict_base_table[bases.reshape(rows, n // 3, 3)]
+        index = codes[..., 0] << 4 | codes[..., 1] << 2 | codes[..., 2]
+        index[(codes > 3).any(axis=-1)] = 255
+        body[:, n + n // 3 + 1 : -1] = self.genetic_code.table[index]
+        body[:, -1] = ord("\n")
+
+        offsets = [f"{self.begin + self.dir * (self.i + r * n):0>10}: " for r in range(rows)]
+        self.i += rows * n
+        if len(offsets[0]) == len(offsets[-1]) == 12:
+            prefix = np.frombuffer("".join(offsets).encode('ascii'), dtype=np.uint8).reshape(rows, 12)
+            return np.concatenate([prefix, body], axis=1).tobytes().decode('latin-1')
+        # offsets of different width, glue row by row
+        body = body.tobytes().decode('latin-1')
+        return "".join(o + body[r * self.width:(r + 1) * self.width] for r, o in enumerate(offsets))
+
+    # format the remaining bases, with the same tail as tabulator
+    def close(self):
+        self.flush()
+        rest = self.pending[0]
+        n = self.n
+        if not rest:
+            return
+        self.output_file.write(f"{self.begin + self.dir * self.i:0>10}: " + format_tail(rest, n, self.genetic_code.code))
+        self.i += len(rest)
+        self.pending = []
+
+# the last row of a record with less than n bases, without the offset
+def format_tail(rest, n, code): # -> str
+    parts = [" ".join(rest[j:j+3] for j in range(0, len(rest), 3))]
+    j = len(rest)
+    # finish the last triplett
+    k = (2 - ((j-1) % 3))
+    parts.append(" " * k)
+    j += k
+    while j % n != 0:
+        parts.append("    ")
+        j += 3
+    if len(rest) % n not in (1,2):
+        parts.append("  " + "".join(code.get(rest[j:j+3], 'X') for j in range(0, len(rest) - 2, 3)))
+    parts.append("\n")
+    return "".join(parts)
+
+# codes 0-3 for uppercase TCAG, 4 for everything else
+strict_base_table = np.full(256, 4, dtype=np.uint8)
+for _i, _base in enumerate("TCAG"):
+    strict_base_table[ord(_base)] = _i
+
+# the layout of the table only depends on n and the offset of each record,
+# so the byte position of every row is known without formatting anything before it.
+# this is used to format large files in parallel, each process writes its rows at their position
+
+# offset and direction of the first base of a record, from a prodigal header
+def record_origin(header): # str -> (int, int)
+    parts = header.split("#")
+    if len(parts) == 5:
+        id, begin, end, dir, notes = parts
+        begin = int(begin.strip())
+        end = int(end.strip())
+        dir = int(dir.strip())
+        return (begin, dir) if dir == 1 else (end, dir)
+    return 0, 1
+
+powers_of_ten = 10 ** np.arange(1, 19, dtype=np.int64)
+
+# length of the row offsets "0000000030: " of rows starting at the bases starts
+def offset_widths(begin, dir, starts): # -> np.array(int)
+    values = begin + dir * np.asarray(starts, dtype=np.int64)
+    digits = np.searchsorted(powers_of_ten, np.abs(values), side='right') + 1 + (values < 0)
+    return np.maximum(digits, 10) + 2
+
+# records of a fasta file as (header, offset, length, linebases, linewidth, begin, dir)
+# offset, length and the line lengths are those of a .fai index, begin and dir from record_origin
+def records(buf):
+    for header, begin, end in fasta.record_spans(buf):
+        header = (">" + header).strip()
+        length, linebases, linewidth = faidx.index_record(buf, begin, end)
+        yield (header, begin, length, linebases, linewidth, *record_origin(header))
+
+# positions in the output of every record: yields (record, header position, chunks)
+# chunks are (first row, last row, position, size) of at most chunk_rows rows each,
+# the last chunk includes the incomplete last row
+def layout(buf, n, chunk_rows=100000):
+    width = n + 2 * (n // 3) + 2 # a row without its offset
+    position = 0
+    for record in records(buf):
+        header, _, length, _, _, begin, dir = record
+        header_position = position
+        position += len(header.encode()) + 1
+        rows = (length + n - 1) // n
+        chunks = []
+        for first in range(0, rows, chunk_rows):
+            last = min(first + chunk_rows, rows)
+            size = int(offset_widths(begin, dir, np.arange(first, last) * n).sum()) + (last - first) * width
+            if last * n > length: # the last row is shorter
+                size += len(format_tail("N" * (length % n), n, code)) - width
+            chunks.append((first, last, position, size))
+            position += size
+        yield record, header_position, chunks
+
+# the rows first to last (exclusive) of a record, exactly as in the whole table
+def render_rows(buf, record, first, last, n, table=11): # -> str
+    header, offset, length, linebases, linewidth, begin, dir = record
+    start = first * n
+    end = min(last * n, length)
+    if start >= end:
+        return ""
+    first_byte, last_byte = faidx.byte_range(offset, linebases, linewidth, start, end)
+    bases = bytes(buf[first_byte:last_byte]).translate(None, b'\r\n').decode('latin-1')
+    output_file = io.StringIO()
+    formatter = BlockFormatter(output_file, begin, dir, n=n, table=table, start=start)
+    formatter.send(bases)
+    if end == length:
+        formatter.close()
+    else:
+        formatter.flush()
+    return output_file.getvalue()
+
+def render_chunk(input_path, output_path, record, first, last, position, n, table=11): # -> int
+    buf = fasta.open_buffer(input_path)
+    data = render_rows(buf, record, first, last, n, table).encode()
+    fd = os.open(output_path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, position)
+    finally:
+        os.close(fd)
+    return len(data)
+
+# format the whole file with a pool of processes into a file of the precomputed size
+# the input needs a regular layout, like for a .fai index
+def render_parallel(input_path, output_path, n, table=11, jobs=None, chunk_rows=100000):
+    buf = fasta.open_buffer(input_path)
+    records_layout = list(layout(buf, n, chunk_rows))
+    total = 0
+    with open(output_path, "wb") as output_file:
+        for record, header_position, chunks in records_layout:
+            output_file.seek(header_position)
+            output_file.write(record[0].encode() + b"\n")
+            if chunks:
+                first, last, position, size = chunks[-1]
+                total = position + size
+            else:
+                total = output_file.tell()
+        output_file.truncate(total)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = []
+        for record, _, chunks in records_layout:
+            for first, last, position, size in chunks:
+                future = executor.submit(render_chunk, input_path, output_path, record, first, last, position, n, table)
+                futures.append((future, size))
+        for future, size in futures:
+            # only happens for non ascii input, that takes more than one byte per base
+            if future.result() != size:
+                raise ValueError("output does not match the precomputed layout, is the input ascii?")
+
 def main():
     parser = argparse.ArgumentParser(
         prog='pretty.py',
@@ -113,33 +319,65 @@ def main():
     parser.add_argument('-i', '--input', default='/dev/fd/0', help="input file, default stdin")
     parser.add_argument('-o', '--output', default='/dev/fd/1', help="output file, default stdout")
     parser.add_argument('-n', '--blocks', default=10, help="the number of tripletts in a row")
+    parser.add_argument('-g', '--table', type=int, default=11, help="ncbi translation table, default 11")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('-r', '--region', action='append', help="only print this region, name[:begin[-end]] 1-based inclusive, uses a .fai index, can be repeated")
+    selection.add_argument('--rows', help="only print the rows of the whole table that contain this region, name[:begin[-end]]")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="format in parallel with this many processes, needs an output file and equal line lengths in the input")
+    parser.add_argument('--chunk-rows', type=int, default=100000, help="rows per parallel job, default 100000")
     args = parser.parse_args()
     global n
     n = int(args.blocks) * 3
+    global code
+    code = get_code(args.table).code
+    if args.jobs > 1 and (args.region or args.rows):
+        parser.error("-j/--jobs formats the whole file, it can't be used with -r/--region or --rows")
+
+    if args.rows:
+        name, begin, end = parse_region(args.rows)
+        buf = fasta.open_buffer(args.input)
+        for record in records(buf):
+            if fasta.record_id(record[0][1:]) == name:
+                length = record[2]
+                end = length if end is None else min(end, length)
+                first = (begin or 0) // n
+                last = (end + n - 1) // n
+                with open(args.output, "w") as output_file:
+                    output_file.write(render_rows(buf, record, first, last, n, args.table))
+                return
+        parser.error(f"sequence {name} not in {args.input}")
+
+    if args.jobs > 1:
+        if os.path.exists(args.output) and not os.path.isfile(args.output):
+            parser.error("parallel output needs a regular file, use -o")
+        render_parallel(args.input, args.output, n, args.table, args.jobs, args.chunk_rows)
+        return
+
+    if args.region:
+        with IndexedFasta(args.input) as fa, open(args.output, "w") as output_file:
+            for region in args.region:
+                name, begin, end = parse_region(region)
+                print(">" + region, file=output_file)
+                # number the bases like the whole table does, from the origin of a prodigal header
+                origin, dir = record_origin(fa.header(name))
+                formatter = BlockFormatter(output_file, origin + dir * (begin or 0), dir, n=n, table=args.table)
+                formatter.send(fa.fetch(name, begin, end))
+                formatter.close()
+        return
 
-    with open(args.input) as input_file, open(args.output, "w") as output_file:
-        gen = mktabulator(output_file)
+    with open(args.input) as input_file, open(args.output, "w", buffering=2**20) as output_file:
+        formatter = BlockFormatter(output_file, n=n, table=args.table)
         for line in input_file:
             line = line.strip()
             if line.startswith(">"):
-                stoptabulator(gen)
+                formatter.close()
                 print(line, file=output_file)
                 # try to read prodigal header
-                parts = line.split("#")
-                if len(parts) == 5:
-                    id, begin, end, dir, notes = parts
-                    begin = int(begin.strip())
-                    end = int(end.strip())
-                    dir = int(dir.strip())
-                    if dir == 1:
-                        gen = mktabulator(output_file, begin, dir)
-                    else:
-                        gen = mktabulator(output_file, end, dir)
-                else:
-                    gen = mktabulator(output_file)
+                begin, dir = record_origin(line)
+                formatter = BlockFormatter(output_file, begin, dir, n=n, table=args.table)
             else:
-                gen.send(line)
-        stoptabulator(gen)
+                formatter.send(line)
+        formatter.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
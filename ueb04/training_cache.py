@@ -0,0 +1,103 @@
+# on-disk cache of pyrodigal training infos
+# entries are keyed by a hash of the training sequences, the pyrodigal version and the training options,
+# so a rerun on the same genome skips training. the cache is bounded in size,
+# the least recently used entries (by modification time, which is updated on every hit) are removed first
+import hashlib
+import os
+import os.path
+import pickle
+import tempfile
+
+import pyrodigal
+
+def default_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "jlu-bio", "pyrodigal")
+
+def training_key(contigs, **options): # [str | bytes] -> str
+    h = hashlib.sha256()
+    h.update(f"pyrodigal {pyrodigal.__version__} {sorted(options.items())}\n".encode())
+    for contig in contigs:
+        if isinstance(contig, str):
+            contig = contig.encode('ascii')
+        h.update(len(contig).to_bytes(8, 'little'))
+        h.update(contig)
+    return h.hexdigest()
+
+class TrainingCache:
+    def __init__(self, directory=None, max_size=256 * 2**20):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key): # -> pyrodigal.TrainingInfo | None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                training_info = pickle.load(f)
+            if not isinstance(training_info, pyrodigal.TrainingInfo):
+                raise TypeError(f"{path} holds no training info")
+            os.utime(path) # mark as recently used
+            return training_info
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # a broken or incompatible entry (e.g. of another pyrodigal build) is a miss,
+            # remove it so the training result replaces it
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, key, training_info):
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file and rename, parallel runs never see half written entries
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(training_info, f)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    # remove least recently used entries until the cache fits into max_size
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by a parallel run
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+# train a gene finder on the contigs, or take the training info from the cache
+def train(contigs, cache=None, **options): # -> pyrodigal.TrainingInfo
+    if cache is not None:
+        key = training_key(contigs, **options)
+        training_info = cache.get(key)
+        if training_info is not None:
+            return training_info
+    training_info = pyrodigal.GeneFinder().train(*contigs, **options)
+    if cache is not None:
+        try:
+            cache.put(key, training_info)
+        except OSError:
+            pass # a read only cache only costs the training time
+    return training_info